@@ -1,25 +1,37 @@
 from __future__ import unicode_literals
 import re, json
+import csv
+import os
 import requests
 import base64
 import time
 import hashlib
+import tempfile
+import random
+import threading
+import uuid
+import zlib
 
-from copy import deepcopy
 from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
-from django.db import models
+from django.db import models, transaction, connection, IntegrityError
+from django.db.models.functions import Cast
 from django.urls import reverse, reverse_lazy
 from django.core.cache import cache
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.auth.models import Permission
 from django.utils.safestring import mark_safe
 from django.utils.html import escape
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.conf import settings
 from django.template.defaultfilters import linebreaksbr
 from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, get_storage_class
 from django.utils import timezone
 
-from guardian.shortcuts import assign_perm, remove_perm, get_perms
+from guardian.models import GroupObjectPermission
 from wand.image import Image
 
 import reversion
@@ -34,6 +46,23 @@ from sign_message.utils import get_dimensions_of_svg
 from color.models import Color
 from remote_job.signals import jobber
 
+def number_sort_key(number):
+    """ We want to be able to sort decimals using SQL sort, so we zero fill left and right of the decimal
+        ['01', '1.11', '1.11.1']
+        ['000000000000001.000000000000000',
+         '000000000000001.110000000000000',
+         '000000000000001.11.100000000000']
+    """
+    num_split = number.split(".")
+    left = num_split[0]
+    if len(num_split) == 1:
+        # No decimal
+        right = ""
+    else:
+        # one or more decimals
+        right = ".".join(num_split[1:])
+    return "{0}.{1}".format(left.zfill(15), right.ljust(15,"0"))
+
 @reversion.register
 class Position(ConversationMixin, ModelWithAttributes):
     """ This is a record recording the position on a zone.
@@ -90,6 +119,309 @@ class Position(ConversationMixin, ModelWithAttributes):
         """ set lat and lng based on pixel position """
         self.lat, self.lng = self.zone.get_latlng_for_xy(x,y)
 
+class SignQuerySet(models.QuerySet):
+    def search(self, query, limit=200):
+        """ Ranked prefix/substring search, using the search index (SignSearchTerm).
+            Every term in the query has to match. Whole terms rank above prefixes, which rank above
+            substrings, and a match in the number/label/tags ranks above one in the attribute values.
+            Terms shorter than SIGN_SEARCH_MIN_TOKEN (default 2) are ignored.
+
+            The matching, ranking and limit are a single grouped query over the (project, term) index.
+            returns a list of up to `limit` signs, best match first. (each with a `search_rank`)
+        """
+        min_length = getattr(settings, 'SIGN_SEARCH_MIN_TOKEN', 2)
+        tokens = [token for token in OrderedDict.fromkeys(search_tokens(query)) if len(token) >= min_length]
+        if not tokens:
+            return []
+        project_ids = list(self.order_by().values_list('project_id', flat=True).distinct())
+        if not project_ids:
+            return []
+
+        # per token, the best score of any of the sign's terms (null when none of them match)
+        token_scores = {}
+        for n, token in enumerate(tokens):
+            token_scores['score_%s' % n] = models.Max(models.Case(
+                models.When(term__startswith=token, offset__gt=0, then=models.F('weight')),
+                models.When(term=token, then=models.F('weight') * 3),
+                models.When(term__startswith=token, then=models.F('weight') * 2),
+                output_field=models.IntegerField(),
+                ))
+        matches = models.Q()
+        for token in tokens:
+            matches |= models.Q(term__startswith=token)
+        rank = None
+        for name in token_scores:
+            rank = models.F(name) if rank is None else rank + models.F(name)
+
+        terms = SignSearchTerm.objects.filter(matches, project_id__in=project_ids, sign_id__in=self.values('id'))
+        # grouped by sign, every token has to match
+        ranked = terms.values('sign_id').annotate(**token_scores).filter(**dict((name + '__isnull', False) for name in token_scores))
+        ranked = list(ranked.annotate(search_rank=rank).order_by('-search_rank', 'sign_id').values_list('sign_id', 'search_rank')[:limit])
+        signs = self.in_bulk([sign_id for sign_id, score in ranked])
+        result = []
+        for sign_id, score in ranked:
+            sign = signs[sign_id]
+            sign.search_rank = score
+            result.append(sign)
+        return result
+
+    def transition(self, state, batch_size=500):
+        """ Move every sign in the queryset to `state`. This is the bulk version of changing
+            sign.state and saving: review_state is reset, the phase/state sorting is updated,
+            and the object permissions are moved with bulk deletes and inserts.
+
+            returns the list of signs that changed state
+        """
+        with transaction.atomic():
+            signs = list(self.exclude(state=state).select_related('state__phase'))
+            if not signs:
+                return []
+            moves = [(sign, sign.state) for sign in signs]
+            changes = {
+                'state': state,
+                'phase': state.phase,
+                'workflow': state.workflow,
+                'review_state': 'N',
+                'state_sort': state.global_order_id(),
+                'phase_sort': state.phase.global_order_id(),
+                'last_modified_date': timezone.now(),
+            }
+            ids = [sign.id for sign in signs]
+            for i in range(0, len(ids), batch_size):
+                Sign.objects.filter(id__in=ids[i:i + batch_size]).update(**changes)
+            for sign in signs:
+                for k, v in changes.items():
+                    setattr(sign, k, v)
+
+            reassign_state_perms(moves, batch_size=batch_size)
+
+            # update() skips the post_save signal (reversion, api sync info)
+            for sign in signs:
+                models.signals.post_save.send(sender=Sign, instance=sign, created=False, update_fields=changes.keys(), raw=False, using=self.db)
+        return signs
+
+class SignManager(models.Manager.from_queryset(SignQuerySet)):
+    def bulk_create_signs(self, specs, created_user=None, auto_number=False, batch_size=500):
+        """ Create many signs at once (eg. a spreadsheet import).
+
+            `specs` is a list of dicts:
+                'sign': an unsaved Sign, with position set (the position may be unsaved, and may be shared)
+                'tags': (optional) list of tags
+                'attribute_instances': (optional) list of unsaved attribute instances for the sign
+                'messages': (optional) list of (unsaved sign message, list of unsaved attribute instances)
+
+            Unlike Sign.save(), the sort keys, numbering, phase mandates, duplicate highlighting,
+            permissions and artwork generation are worked out once for the whole batch.
+        """
+        signs = [spec['sign'] for spec in specs]
+        if not signs:
+            return []
+
+        # numbering, reserved in one block per numbering scope. This is done before the import's transaction,
+        # so the sequences aren't locked (holding up everyone creating signs in those scopes) until it commits.
+        # If the import fails, the numbers are skipped.
+        if auto_number:
+            scopes = OrderedDict()
+            for sign in signs:
+                zone = sign.position.zone
+                if not sign.number and zone.project.auto_numbering != "0":
+                    scopes.setdefault((zone.project, zone, sign.sign_template), []).append(sign)
+            for (project, zone, sign_template), scope_signs in scopes.items():
+                numbers = reserve_sign_numbers(project, zone, sign_template, len(scope_signs))
+                for sign, number in zip(scope_signs, numbers):
+                    sign.number = number
+
+        with transaction.atomic():
+            # positions
+            new_positions = OrderedDict()
+            for sign in signs:
+                position = sign.position
+                if position.pk is None and id(position) not in new_positions:
+                    position.project = position.zone.project
+                    new_positions[id(position)] = position
+            Position.objects.bulk_create(new_positions.values(), batch_size=batch_size)
+
+            # shortcut fks and sorting methods
+            global_order_ids = {}
+            def global_order_id(obj):
+                if obj is None:
+                    return ""
+                key = (obj.__class__, obj.pk)
+                if key not in global_order_ids:
+                    global_order_ids[key] = obj.global_order_id()
+                return global_order_ids[key]
+
+            for spec in specs:
+                sign = spec['sign']
+                sign.position = sign.position     # picks up the id of a newly created position
+                sign.zone = sign.position.zone
+                sign.project = sign.position.project
+                if sign.state:
+                    sign.phase = sign.state.phase
+                    # by id, the workflow itself isn't needed
+                    sign.workflow_id = sign.state.workflow_id
+                if created_user and not sign.created_user_id:
+                    sign.created_user = created_user
+                sign.phase_sort = global_order_id(sign.phase if sign.phase_id else None)
+                sign.state_sort = global_order_id(sign.state)
+                sign.zone_sort = global_order_id(sign.zone)
+                sign.sign_template_sort = global_order_id(sign.sign_template)
+                # set from the database once the tags are added (see tags_sort_values)
+                sign.tags_sort = ""
+
+            for sign in signs:
+                if sign.number:
+                    sign.number_sort = number_sort_key(sign.number)
+                else:
+                    sign.number_sort = ""
+            advance_sign_number_sequences([sign for sign in signs if sign.number])
+
+            # update phase mandates to include zone/type
+            mandates = OrderedDict()
+            for sign in signs:
+                if sign.phase_id:
+                    phase, zones, sign_templates = mandates.setdefault(sign.phase_id, (sign.phase, set(), set()))
+                    if sign.zone:
+                        zones.add(sign.zone)
+                    if sign.sign_template:
+                        sign_templates.add(sign.sign_template)
+            for phase, zones, sign_templates in mandates.values():
+                existing = set(phase.zones.values_list('id', flat=True))
+                missing = [z for z in zones if z.id not in existing]
+                if missing:
+                    phase.zones.add(*missing)
+                existing = set(phase.sign_templates.values_list('id', flat=True))
+                missing = [st for st in sign_templates if st.id not in existing]
+                if missing:
+                    phase.sign_templates.add(*missing)
+
+            self.bulk_create(signs, batch_size=batch_size)
+
+            # tags
+            through = Sign.tags.through
+            through.objects.bulk_create([
+                through(sign_id=spec['sign'].id, tag_id=tag.id)
+                for spec in specs for tag in spec.get('tags', [])
+                ], batch_size=batch_size)
+            tagged = [spec['sign'] for spec in specs if spec.get('tags')]
+            for i in range(0, len(tagged), batch_size):
+                values = tags_sort_values([sign.id for sign in tagged[i:i + batch_size]])
+                for sign in tagged[i:i + batch_size]:
+                    sign.tags_sort = values[sign.id]
+                _write_tags_sort(values)
+
+            # message and meta
+            attribute_instances = []
+            messages = []
+            for spec in specs:
+                for ai in spec.get('attribute_instances', []):
+                    ai.content_object = spec['sign']
+                    attribute_instances.append(ai)
+                for message, message_ais in spec.get('messages', []):
+                    message.sign = spec['sign']
+                    messages.append(message)
+            _bulk_create_mixed(messages, batch_size)
+
+            # repeating
+            for spec in specs:
+                for message, message_ais in spec.get('messages', []):
+                    for ai in message_ais:
+                        ai.content_object = message
+                        attribute_instances.append(ai)
+            _bulk_create_mixed(attribute_instances, batch_size)
+
+            for project in set(sign.project for sign in signs):
+                rebuild_conflicts(project)
+
+            bulk_assign_perms(sign_state_perms(signs), batch_size=batch_size)
+
+            # bulk_create skips the post_save signal (reversion, api sync info)
+            for sign in signs:
+                models.signals.post_save.send(sender=Sign, instance=sign, created=True, update_fields=None, raw=False, using=self.db)
+
+        request_artwork([sign.id for sign in signs], priority="bulk")
+        request_reindex([sign.id for sign in signs])
+        request_api_json_refresh("sign", [sign.id for sign in signs])
+        return signs
+
+    def clone_many(self, signs, target_zone=None, user=None, with_attachments=False, batch_size=500):
+        """ Copy many signs at once (eg. duplicating a zone layout), including position, tags, fields and attributes.
+            Signs that share a position keep sharing a (new) position.
+            Without a target_zone the copies stay beside the originals and are numbered "<number> (cloned)",
+            with a target_zone the positions are moved there and the numbers are kept.
+
+            Everything is inserted with bulk_create_signs, in one revision.
+            returns the new signs, in the same order as `signs`
+        """
+        if isinstance(signs, models.QuerySet):
+            order = None
+            if not signs.ordered:
+                signs = signs.order_by('zone_sort', 'number_sort', 'id')
+        else:
+            order = [sign.id for sign in signs]
+            signs = Sign.objects.filter(id__in=order)
+        signs = list(signs.select_related('position__zone__project', 'state__phase', 'sign_template').prefetch_related(
+            'tags',
+            'attribute_instances',
+            'sign_messages__attribute_instances',
+            ))
+        if not signs:
+            return []
+
+        positions = {}
+        specs = []
+        for old_sign in signs:
+            if old_sign.position_id not in positions:
+                # the zone (and its project) that were loaded with the sign, rather than fetching them again
+                positions[old_sign.position_id] = _copy_instance(old_sign.position, zone=target_zone or old_sign.position.zone)
+            new_sign = _copy_instance(old_sign, position=positions[old_sign.position_id], state=old_sign.state, sign_template=old_sign.sign_template)
+            if not target_zone:
+                new_sign.number = "{0} (cloned)".format(new_sign.number)
+            specs.append({
+                'sign': new_sign,
+                'tags': list(old_sign.tags.all()),
+                'attribute_instances': [_copy_instance(ai) for ai in old_sign.attribute_instances.all()],
+                'messages': [
+                    (_copy_instance(message), [_copy_instance(ai) for ai in message.attribute_instances.all()])
+                    for message in old_sign.sign_messages.all()
+                ],
+            })
+
+        with reversion.create_revision():
+            new_signs = self.bulk_create_signs(specs, batch_size=batch_size)
+
+            # Copy attachments only
+            if with_attachments:
+                comments = []
+                for old_sign, new_sign in zip(signs, new_signs):
+                    new_conversation = None
+                    for old_comment in old_sign.conversation().comments.all().reverse():
+                        if old_comment.attachment:
+                            if new_conversation is None:
+                                new_conversation = new_sign.conversation()
+                            comments.append(_copy_instance(old_comment, conversation=new_conversation))
+                _bulk_create_mixed(comments, batch_size)
+
+            if user:
+                reversion.set_user(user)
+            if len(new_signs) == 1:
+                reversion.set_comment(json.dumps({
+                    'title': str(new_signs[0]),       # 'B1-004', '7 signs'
+                    'url': str(new_signs[0].get_absolute_url()),
+                    'summary': "created this sign based on <a href='{0}'>{0}</a>".format(signs[0].get_absolute_url()),
+                    }, indent=4))
+            else:
+                reversion.set_comment(json.dumps({
+                    'title': "{0} signs".format(len(new_signs)),
+                    'url': str(new_signs[0].get_absolute_url()),
+                    'summary': "created {0} signs based on existing signs".format(len(new_signs)),
+                    }, indent=4))
+
+        if order is None:
+            return new_signs
+        by_old_id = dict((old_sign.id, new_sign) for old_sign, new_sign in zip(signs, new_signs))
+        return [by_old_id[sign_id] for sign_id in order]
+
 @reversion.register
 class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
     """ The actual sign """
@@ -138,7 +470,7 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
     override_pdf_as_png = models.FileField(max_length=255, null=True, blank=True)
     override_artwork_up_to_date = models.BooleanField(default=False, help_text="Used to determine if a message should warn the user that artwork is out of date. This turns true when new pdf is uploaded. This turns false when the sign template or attribute instances change.")
 
-    # Json data used in the API. Note, these only update on sign form save, not when inherieted fields change
+    # Json data used in the API. Kept up to date by the sign:refresh_api_json job, including when inherited fields change
     message_json = models.TextField(null=True, blank=True)
     repeating_message_json = models.TextField(null=True, blank=True)
     meta_json = models.TextField(null=True, blank=True)
@@ -147,6 +479,8 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
     REVIEW_STATE_CHOICES = (('A', 'Approved'), ('R', 'Rejected'),('N', 'Needs Review'))
     review_state = models.CharField(max_length=1, choices=REVIEW_STATE_CHOICES, default='N')
 
+    objects = SignManager()
+
     class Meta:
         permissions = (
             ('view_sign', 'View sign'),
@@ -167,6 +501,7 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
             self.__is_new = True
 
     def save(self, *args, **kwargs):
+        self._api_json = None
         self.zone = self.position.zone
         self.project = self.position.project
         if self.state:
@@ -174,34 +509,12 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
             self.phase = self.state.phase
             self.workflow = self.state.workflow
 
-        # create the override_pdf_as_png
-        # we do the prep work before Super so that if it fails, nothing has changed
-        if self.override_pdf and self.__original_override_pdf != self.override_pdf:
-            self.override_pdf.seek(0)
-            with Image(file=self.override_pdf, resolution=100) as img:
-                # remove any transparency
-                # img.background_color = Color('white')
-                # img.alpha_channel = 'remove'
-
-                # max_length = max(img.width, img.height)
-                # if max_length > 1000:
-                #     # we need to scale it down a bit.
-                #     factor = 1000.0/max_length
-                #     new_width = int(img.width * factor)
-                #     new_height = int(img.height * factor)
-                #     img.resize(width=new_width, height=new_height)
-
-                # Always resize so that width is 500px
-                new_width = 500
-                new_height = int(img.height * 500 / img.width)
-                img.resize(width=new_width, height=new_height)
-
-                with img.convert("PNG") as converted_img:
-                    # put the image data in a django friendly object (https://docs.djangoproject.com/en/dev/ref/files/file/#django.core.files.File)
-                    override_pdf_as_png_cf = ContentFile(converted_img.make_blob())
-                    override_pdf_as_png_name = u"sign_override_artwork_%s.png" % self.id
-                    self.override_pdf_as_png.save(override_pdf_as_png_name, override_pdf_as_png_cf, save=False)
-                    self.override_artwork_up_to_date = True
+        # the override_pdf_as_png previews are made by a background job (see generate_override_previews)
+        # until then, the "generating" placeholder is served
+        override_pdf_changed = bool(self.override_pdf) and self.__original_override_pdf != self.override_pdf
+        if override_pdf_changed:
+            self.override_pdf_as_png = None
+            self.override_artwork_up_to_date = True
 
         # reset review state if state changes
         if self.state_id and self.__original_state_id != self.state_id:
@@ -235,21 +548,7 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
 
             if self.number:
                 if self.__original_number != self.number:
-                    # We want to be able to sort decimals using SQL sort, so we zero fill left and right of the decimal
-                    # ['01', '1.11', '1.11.1']
-                    # ['000000000000001.000000000000000',
-                    #  '000000000000001.110000000000000',
-                    #  '000000000000001.11.100000000000']
-                    num_split = self.number.split(".")
-                    left = num_split[0]
-                    if len(num_split) == 1:
-                        # No decimal
-                        right = ""
-                    else:
-                        # one or more decimals
-                        right = ".".join(num_split[1:])
-
-                    self.number_sort = "{0}.{1}".format(left.zfill(15), right.ljust(15,"0"))
+                    self.number_sort = number_sort_key(self.number)
             else:
                 self.number_sort = ""
 
@@ -276,92 +575,12 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
                 self.sign_template_sort = ""
 
             if self.number:
-                # We want to be able to sort decimals using SQL sort, so we zero fill left and right of the decimal
-                # ['01', '1.11', '1.11.1']
-                # ['000000000000001.000000000000000',
-                #  '000000000000001.110000000000000',
-                #  '000000000000001.11.100000000000']
-                num_split = self.number.split(".")
-                left = num_split[0]
-                if len(num_split) == 1:
-                    # No decimal
-                    right = ""
-                else:
-                    # one or more decimals
-                    right = ".".join(num_split[1:])
-
-                self.number_sort = "{0}.{1}".format(left.zfill(15), right.ljust(15,"0"))
+                self.number_sort = number_sort_key(self.number)
             else:
                 self.number_sort = ""
 
-        if self.__is_new or self.__original_number != self.number or self.__original_sign_template_id != self.sign_template_id or self.__original_zone_id != self.zone_id:
-            # check for id conflicts.
-            if self.sign_template and self.zone:
-                # We need to remove the highlighting when there is no longer a conflict
-                # Start by removing the highlight
-                self.has_conflict_type_location_number = False
-                # We exclude ourself because it cause problems when multiple saves occur
-                qs = Sign.objects.filter(project=self.project, sign_template_id=self.__original_sign_template_id, zone_id=self.__original_zone_id, number=self.__original_number).exclude(id=self.id)
-                if len(qs) == 1:
-                    # There is only one other conflict so remove the highlighting from the other
-                    for sign in qs:
-                        sign.has_conflict_type_location_number = False
-                        sign.save()
-
-                qs = Sign.objects.filter(project=self.project, sign_template=self.sign_template, zone=self.zone, number=self.number).exclude(id=self.id)
-                if len(qs) > 0:
-                    # If there is more than 0 signs, there is a conflict
-                    for sign in qs:
-                        if not sign.has_conflict_type_location_number:
-                            sign.has_conflict_type_location_number = True
-                            sign.save()
-
-                    self.has_conflict_type_location_number = True
-
-            if self.zone:
-                # We need to remove the highlighting when there is no longer a conflict
-                # Start by removing the highlight
-                self.has_conflict_location_number = False
-                # We exclude ourself because it cause problems when multiple saves occur
-                qs = Sign.objects.filter(project=self.project, zone_id=self.__original_zone_id, number=self.__original_number).exclude(id=self.id)
-                if len(qs) == 1:
-                    # There is only one other conflict so remove the highlighting from the other
-                    for sign in qs:
-                        sign.has_conflict_location_number = False
-                        sign.save()
-
-                qs = Sign.objects.filter(project=self.project, zone=self.zone, number=self.number).exclude(id=self.id)
-                if len(qs) > 0:
-                    # If there is more than 0 signs, there is a conflict
-                    for sign in qs:
-                        if not sign.has_conflict_location_number:
-                            sign.has_conflict_location_number = True
-                            sign.save()
-
-                    self.has_conflict_location_number = True
-
-            if self.sign_template:
-                # We need to remove the highlighting when there is no longer a conflict
-                # Start by removing the highlight
-                self.has_conflict_type_number = False
-                # We exclude ourself because it cause problems when multiple saves occur
-                qs = Sign.objects.filter(project=self.project, sign_template_id=self.__original_sign_template_id, number=self.__original_number).exclude(id=self.id)
-                if len(qs) == 1:
-                    # There is only one other conflict so remove the highlighting from the other
-                    for sign in qs:
-                        sign.has_conflict_type_number = False
-                        sign.save()
-
-                qs = Sign.objects.filter(project=self.project, sign_template=self.sign_template, number=self.number).exclude(id=self.id)
-                if len(qs) > 0:
-                    # If there is more than 0 signs, there is a conflict
-                    for sign in qs:
-                        if not sign.has_conflict_type_number:
-                            sign.has_conflict_type_number = True
-                            sign.save()
-
-                    self.has_conflict_type_number = True
-
+        # duplicate number highlighting is refreshed (with bulk updates) once we have been saved
+        update_conflicts = self.__is_new or self.__original_number != self.number or self.__original_sign_template_id != self.sign_template_id or self.__original_zone_id != self.zone_id
 
         # tags are handled through the m2m_changed signal handler below
 
@@ -374,15 +593,31 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
 
         result = super(Sign, self).save(*args, **kwargs)
 
-        # invalidate cached sign label (just in case sign_template has changed)
-        # todo: check whether sign_template has actually changed
-        keys = [
-            "sign_unicode:%s" % self.id,
-            "sign_svg_as_png:%s" % self.id,
-            "sign_message_html:%s" % self.id,
-        ]
-        cache.delete_many(keys)
-        job = jobber.send(name='sign:generate_artwork', sign_ids=[self.id,], delay_seconds=30)
+        if update_conflicts:
+            conflict_keys = [self.conflict_key()]
+            if not self.__is_new:
+                conflict_keys.append({
+                    'sign_template_id': self.__original_sign_template_id,
+                    'zone_id': self.__original_zone_id,
+                    'number': self.__original_number,
+                })
+            group_sizes = refresh_conflict_groups(self.project_id, conflict_keys)
+            if self.number:
+                advance_sign_number_sequences([self])
+            # the bulk update doesn't touch our in-memory copy
+            for flag, fields in CONFLICT_GROUPINGS:
+                group = conflict_group(conflict_keys[0], fields)
+                setattr(self, flag, group_sizes[flag].get(group, 0) > 1)
+
+        # invalidate the cached sign label, summaries and png (see derived_get_many)
+        bump_generation("sign", self.id)
+        request_artwork([self.id])
+        request_reindex([self.id])
+        request_api_json_refresh("sign", [self.id])
+
+        if override_pdf_changed:
+            self.__original_override_pdf = self.override_pdf
+            request_override_previews(self.id, self.override_pdf.name)
 
         if self.state and (self.__is_new or self.__original_state_id != self.state_id):
             old_state = State.objects.filter(pk=self.__original_state_id)
@@ -393,131 +628,67 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
 
         return result
 
+    def override_preview_name(self, size="detail"):
+        """ the storage name of an override pdf preview (detail is the override_pdf_as_png itself), or None """
+        if not self.override_pdf_as_png:
+            return None
+        if size == "detail":
+            return self.override_pdf_as_png.name
+        base = self.override_pdf_as_png.name.rsplit(".", 1)[0]
+        return u"{0}_{1}.png".format(base, size)
+
+    def override_preview_url(self, size="detail"):
+        """ the url of an override pdf preview, or None while it's being generated """
+        name = self.override_preview_name(size)
+        if name is None:
+            return None
+        return self.override_pdf_as_png.storage.url(name)
+
+    def override_preview(self, size="detail"):
+        """ the png of an override pdf preview, or the "generating" placeholder until it's ready """
+        name = self.override_preview_name(size)
+        if name is None:
+            return generating_artwork_placeholder()
+        storage = self.override_pdf_as_png.storage
+        with storage.open(name) as f:
+            return f.read()
+
+    def compiled_template(self):
+        """ the CompiledSignTemplate for our sign template (or None) """
+        if not self.sign_template_id:
+            return None
+        return compiled_sign_template(self.sign_template)
+
+    def conflict_key(self):
+        """ the values used to group signs when looking for duplicate numbers """
+        return {
+            'sign_template_id': self.sign_template_id,
+            'zone_id': self.zone_id,
+            'number': self.number,
+        }
+
     def clone(self, request):
         """Used to copy a sign and change it's id including position, fields and attributes"""
-        # Declare a revision block.
-        with reversion.create_revision():
-            new_sign = deepcopy(self)
-            new_sign.number = "{0} (cloned)".format(new_sign.number)
-            new_sign.id = None
-            # create a new position
-            position = deepcopy(self.position)
-            position.id = None
-            position.save()
-            new_sign.position = position
-            new_sign.save()
-
-            # special handling for tags, needs an ID before many-to-many relationship can be used.
-            new_sign.tags = self.tags.all()
-            new_sign.save()
-
-            # Message and meta
-            for old_ai in self.attribute_instances.all():
-                new_ai = deepcopy(old_ai)
-                new_ai.id = None
-                new_ai.content_object = new_sign
-                # ai.object_id = sign.id
-                new_ai.save()
-
-            # Repeating
-            for old_message in self.sign_messages.all():
-                new_message = deepcopy(old_message)
-                new_message.id = None
-                new_message.sign = new_sign
-                new_message.save()
-
-                for old_ai in old_message.attribute_instances.all():
-                    new_ai = deepcopy(old_ai)
-                    new_ai.id = None
-                    new_ai.content_object = new_message
-                    new_ai.save()
-
-            reversion.set_user(request.user)
-            reversion.set_comment(json.dumps({
-                'title': str(new_sign),       # 'B1-004', '7 signs'
-                'url': str(new_sign.get_absolute_url()),
-                'summary': "created this sign based on <a href='{0}'>{0}</a>".format(self.get_absolute_url()),
-                }, indent=4))
-
-            if new_sign.state:
-                new_sign.assign_remove_perms(None)
-
-        return new_sign
+        return Sign.objects.clone_many([self], user=request.user)[0]
 
     def clone_with_attachments(self, request):
-        """Used to copy a sign and change it's id including position, fields and attributes"""
-        # Declare a revision block.
-        with reversion.create_revision():
-            new_sign = deepcopy(self)
-            new_sign.number = "{0} (cloned)".format(new_sign.number)
-            new_sign.id = None
-            # create a new position
-            position = deepcopy(self.position)
-            position.id = None
-            position.save()
-            new_sign.position = position
-            new_sign.save()
-
-            # special handling for tags, needs an ID before many-to-many relationship can be used.
-            new_sign.tags = self.tags.all()
-            new_sign.save()
-
-            # Message and meta
-            for old_ai in self.attribute_instances.all():
-                new_ai = deepcopy(old_ai)
-                new_ai.id = None
-                new_ai.content_object = new_sign
-                # ai.object_id = sign.id
-                new_ai.save()
-
-            # Repeating
-            for old_message in self.sign_messages.all():
-                new_message = deepcopy(old_message)
-                new_message.id = None
-                new_message.sign = new_sign
-                new_message.save()
-
-                for old_ai in old_message.attribute_instances.all():
-                    new_ai = deepcopy(old_ai)
-                    new_ai.id = None
-                    new_ai.content_object = new_message
-                    new_ai.save()
-
-            reversion.set_user(request.user)
-            reversion.set_comment(json.dumps({
-                'title': str(new_sign),       # 'B1-004', '7 signs'
-                'url': str(new_sign.get_absolute_url()),
-                'summary': "created this sign based on <a href='{0}'>{0}</a>".format(self.get_absolute_url()),
-                }, indent=4))
-
-            if new_sign.state:
-                new_sign.assign_remove_perms(None)
-
-            # Copy attachments only
-            new_conversation = new_sign.conversation()
-            for old_comment in self.conversation().comments.all().reverse():
-                if old_comment.attachment:
-                    new_comment = deepcopy(old_comment)
-                    new_comment.id = None
-                    new_comment.conversation = new_conversation
-                    new_comment.save()
-
-        return new_sign
+        """Used to copy a sign and change it's id including position, fields, attributes and attachments"""
+        return Sign.objects.clone_many([self], user=request.user, with_attachments=True)[0]
 
     def update_combined_search_text(self):
-        """ You must save after this method. This does not happen in the save method because attributes are created after """
-        combined_search_text = u""
+        """ You must save after this method. This does not happen in the save method because attributes are created after
+            (the search index is kept up to date by reindex_signs)
+        """
+        self.combined_search_text = u"".join(u" " + value for value in self.search_attribute_values())
 
+    def search_attributes(self):
+        """ returns the (message and meta, repeating) attributes whose values are searchable """
         # message and meta Attributes
         attributes = list(Attribute.objects.filter(
                                 is_inheritable=False,
                                 sign_template_attributes__is_repeating=False,
                                 sign_template_attributes__sign_template=self.sign_template
                                 ).distinct().order_by('sign_template_attributes'))
-        for a in attributes:
-            value, source = self.local_attributes().get(a.slug, ('',None))
-            combined_search_text += u" " + unicode(value)
-
 
         # repeating attributes
         attributes_repeating = list(Attribute.objects.filter(
@@ -526,22 +697,30 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
                                 sign_template_attributes__is_repeating=True,
                                 sign_template_attributes__sign_template=self.sign_template
                                 ).distinct().order_by('sign_template_attributes'))
+        return attributes, attributes_repeating
+
+    def search_attribute_values(self, search_attributes=None):
+        """ returns the values of the searchable attributes (see search_attributes) """
+        if search_attributes is None:
+            search_attributes = self.search_attributes()
+        attributes, attributes_repeating = search_attributes
+        values = []
+
+        local_attributes = self.local_attributes()
+        for a in attributes:
+            value, source = local_attributes.get(a.slug, ('',None))
+            values.append(unicode(value))
+
         message_list = list(self.sign_messages.all())
         number_of_real_messages = min(len(message_list), getattr(self.sign_template, 'number_of_messages', 0))
         # (we take the min because there may be message objects created and # of messages reduced)
 
         for k in range(number_of_real_messages):
-            message = message_list[k]
-            message_dict = message.attribute_instances_dict()
-
+            message_dict = message_list[k].attribute_instances_dict()
             for a in attributes_repeating:
-                try:
-                    value, source = message_dict.get(a.slug,('',None))
-                except KeyError:
-                    value = ""
-                combined_search_text += u" " + unicode(value)
-
-        self.combined_search_text = combined_search_text
+                value, source = message_dict.get(a.slug,('',None))
+                values.append(unicode(value))
+        return values
 
     def should_highlight_type(self):
         # Used on sign form to add highlighting of duplicates
@@ -557,60 +736,7 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
 
     def assign_remove_perms(self, old_state):
         """When ever a sign is saved on the form or by state action"""
-        position = self.position
-        new_state = self.state
-        if old_state:
-            old_phase_member_group = old_state.phase.get_member_group()
-            old_phase_viewer_group = old_state.phase.get_viewer_group()
-            old_state_viewer_group = old_state.get_viewer_group()
-            remove_perm('change_sign', old_phase_member_group, self)
-            remove_perm('view_sign', old_phase_member_group, self)
-            remove_perm('view_sign', old_phase_viewer_group, self)
-            remove_perm('view_sign', old_state_viewer_group, self)
-            remove_perm('review_sign', old_state_viewer_group, self)
-
-            # can we remove perms to the position? Check all other signs under this position
-            other_sign_phase_member_change = False
-            other_sign_phase_member_view = False
-            other_sign_phase_viewer = False
-            other_sign_state_viewer = False
-            for other_sign in position.signs.exclude(pk=self.id):
-                #if we have permission to another sign under this position, flag True
-                if 'change_sign' in get_perms(old_phase_member_group, other_sign):
-                    other_sign_phase_member_change = True
-
-                if 'view_sign' in get_perms(old_phase_member_group, other_sign):
-                    other_sign_phase_member_view = True
-
-                if 'view_sign' in get_perms(old_phase_viewer_group, other_sign):
-                    other_sign_phase_viewer = True
-
-                if 'view_sign' in get_perms(old_state_viewer_group, other_sign):
-                    other_sign_state_viewer = True
-
-            # if no other sign on this position has perms, remove the position perms
-            if not other_sign_phase_member_change:
-                remove_perm('change_position', old_phase_member_group, position)
-            if not other_sign_phase_member_view:
-                remove_perm('view_position', old_phase_member_group, position)
-            if not other_sign_phase_viewer:
-                remove_perm('view_position', old_phase_viewer_group, position)
-            if not other_sign_state_viewer:
-                remove_perm('view_position', old_state_viewer_group, position)
-
-        new_phase_member_group = new_state.phase.get_member_group()
-        new_phase_viewer_group = new_state.phase.get_viewer_group()
-        new_state_viewer_group = new_state.get_viewer_group()
-        assign_perm('change_sign', new_phase_member_group, self)
-        assign_perm('view_sign', new_phase_member_group, self)
-        assign_perm('view_sign', new_phase_viewer_group, self)
-        assign_perm('view_sign', new_state_viewer_group, self)
-        assign_perm('review_sign', new_state_viewer_group, self)
-
-        assign_perm('change_position', new_phase_member_group, position)
-        assign_perm('view_position', new_phase_member_group, position)
-        assign_perm('view_position', new_phase_viewer_group, position)
-        assign_perm('view_position', new_state_viewer_group, position)
+        reassign_state_perms([(self, old_state)])
 
     def attributes(self):
         attributes = {}
@@ -641,9 +767,16 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
 
         # local
         attributes.update(self.attribute_instances_dict())
-        ct = ContentType.objects.get_for_model(self)
-        if self.sign_template:
-            attributes['sign_template'] = (unicode(self.sign_template), {'content_type': ct.id, 'object_id': self.id})
+        self.add_synthetic_attributes(attributes, ContentType.objects.get_for_model(self))
+
+        return attributes
+
+    def add_synthetic_attributes(self, attributes, ct, sign_template=None):
+        """ add the attributes that come from the sign itself, rather than from attribute instances """
+        if sign_template is None:
+            sign_template = self.sign_template
+        if sign_template:
+            attributes['sign_template'] = (unicode(sign_template), {'content_type': ct.id, 'object_id': self.id})
         attributes['number'] = (self.number, {'content_type': ct.id, 'object_id': self.id})
         attributes['sign_id'] = ('{0} - {1} - {2}'.format(attributes['type.short_code_combo'][0], attributes['location.short_code_combo'][0], self.number), {'content_type': ct.id, 'object_id': self.id})
         attributes['last_modified_date'] = (self.last_modified_date.now().strftime("%Y-%m-%d"), {'content_type': ct.id, 'object_id': self.id})
@@ -651,8 +784,6 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
         attributes['last_modified_month'] = (self.last_modified_date.now().strftime("%m"), {'content_type': ct.id, 'object_id': self.id})
         attributes['last_modified_day'] = (self.last_modified_date.now().strftime("%d"), {'content_type': ct.id, 'object_id': self.id})
 
-        return attributes
-
     def local_attributes(self):
         """ like attributes, but without any inheritance """
         attributes = {}
@@ -669,10 +800,8 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
     def repeating_attributes(self):
         """Used on the sign form for templating fields"""
         attributes = {}
-        repeating_attributes = []
+        repeating_attributes = self.compiled_template().repeating_attributes
         ct = ContentType.objects.get_for_model(self)
-        for sta in self.sign_template.sign_template_attributes.filter(is_repeating=True):
-            repeating_attributes.append(sta.attribute)
         for i, m in enumerate(self.sign_messages.all()):
             prefixes = ["message_%s" % (i+1)]
             if i == 0:
@@ -686,248 +815,66 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
                     attributes[field_key] = (v, {'content_type': ct.id, 'object_id': self.id})
         return attributes
 
+    def api_json(self):
+        """ returns (message_json, repeating_message_json, meta_json). Used in API, see api_json_for_signs
+
+            Built once per instance; save() forgets it.
+        """
+        if getattr(self, '_api_json', None) is None:
+            self._api_json = api_json_for_signs([self])[self.id]
+        return self._api_json
+
     def get_message_json(self):
         """ Create a json of message attributes. Used in API """
-        message_dict = OrderedDict()
-        if self.sign_template:
-            attributes_message = self.sign_template.message_attributes()
-            for a in attributes_message:
-                value, source = self.attributes().get(a.slug, ('',None))
-                if value != '-unknown-':
-                    value = escape(value)
-                    message_dict[unicode(a)] = {'type': a.field_type, 'value': value}
-        if message_dict:
-            return json.dumps(message_dict, indent=4)
-        return None
+        return self.api_json()[0]
 
     def get_repeating_message_json(self):
         """ Create a json of repeating message attributes. Used in API """
-        repeating_message_dict = OrderedDict()
-        if self.sign_template:
-            attributes_repeating = self.sign_template.repeating_attributes()
-
-            for a in attributes_repeating:
-                repeating_message_dict[unicode(a)] = {'type': a.field_type, 'values': []}
-
-            if attributes_repeating:
-                message_list = list(self.sign_messages.all())
-                number_of_real_messages = min(len(message_list), self.sign_template.number_of_repeating())
-                # we take the min because there may be message objects created and # of messages reduced
-                for k in range(number_of_real_messages):
-                    message = message_list[k]
-                    for a in attributes_repeating:
-                        value, source = message.attribute_instances_dict().get(a.slug, ("", None))
-                        repeating_message_dict[unicode(a)]['values'].append(value)
-                for k in range(number_of_real_messages, self.sign_template.number_of_repeating()):
-                    repeating_message_dict[unicode(a)]['values'].append("")
-        if repeating_message_dict:
-            return json.dumps(repeating_message_dict, indent=4)
-        return None
+        return self.api_json()[1]
 
     def get_meta_json(self):
-        """ Create a json of message attributes. Used in API """
-        meta_dict = OrderedDict()
-        if self.sign_template:
-            attributes_meta = self.sign_template.meta_attributes()
-            aid = self.attribute_instances_dict()
-            for a in attributes_meta:
-                value, source = aid.get(a.slug, ('',None))
-                if value != '-unknown-':
-                    value = escape(value)
-                    meta_dict[unicode(a)] = {'type': a.field_type, 'value': value}
-        if meta_dict:
-            return json.dumps(meta_dict, indent=4)
-        return None
+        """ Create a json of meta attributes. Used in API """
+        return self.api_json()[2]
 
     def message_html(self):
         """ Used to show a brief summary of message info for sign hover and expanded list view """
+        html, colors = self.message_html_parts()
+        return color_css(colors) + html
+
+    def message_html_parts(self):
+        """ message_html without the color css, returns (html, list of colors used) """
         if self.id:
-            key = "sign_message_html:%s" % self.id
-            result = cache.get(key)
-            if result:
+            result, signature = derived_get("sign_message_summary", self)
+            if result is not None:
                 return result
 
-        html = ""
-        if self.sign_template:
-            attributes_message = self.sign_template.message_attributes()
-            sign_attribute_data = self.attributes()
-            attribute_instances_text_dict = self.attribute_instances_text_dict()
-            for a in attributes_message:
-                value, source = sign_attribute_data.get(a.slug, ('',None))
-                if value and value != '-unknown-':
-                    value = escape(value)
-                    html += "<b>"+unicode(a)+"</b>"
-                    if a.field_type == "color":
-                        html += """<style>
-                                    @media all{
-                                    .color_"""+value+"""{
-                                        background-color: #"""+value+""" !important;
-                                        color: #"""+font_color(value)+""" !important;
-                                        padding: 3px !important;
-                                        }
-                                    }
-                                </style>"""
-                        html += "<p class='color_"+value+"'>"+value+"</p>"
-                    elif a.field_type in ["color_x",'color_t']:
-                        color = Color.objects.get(id=value)
-                        html += """<style>
-                                    @media all{
-                                    .color_"""+color.color+"""{
-                                        background-color: #"""+color.color+""" !important;
-                                        color: #"""+font_color(color.color)+""" !important;
-                                        padding: 3px !important;
-                                        }
-                                    }
-                                </style>"""
-                        html += "<p class='color_"+color.color+"'>"+color.name+"</p>"
-                    elif a.field_type in ["icon",'icon_t']:
-                        unused_value, source, text_value = attribute_instances_text_dict.get(a.slug, ('',None,''))
-                        html += "<p><img height='15px' src='/sign_message/icon/"+value+"/thumbnail_url/40/' alt='"+text_value+"'></p>"
-                    else:
-                        html += "<p>"+linebreaksbr(value)+"</p>"
-
-            attributes_repeating = self.sign_template.repeating_attributes()
-
-            message_list = list(self.sign_messages.all())
-            number_of_real_messages = min(len(message_list), self.sign_template.number_of_repeating())
-            # we take the min because there may be message objects created and # of messages reduced
-            # Find the first non empty value and set the counter to remove empty values
-            if attributes_repeating:
-                attributes_repeating_count = len(attributes_repeating)
-                for k in range(number_of_real_messages-1,-1,-1):
-                    #check the last element to see if its empty
-                    message = message_list[k]
-                    message_data = message.attribute_instances_dict()
-                    for a in attributes_repeating:
-                        value, source = message_data.get(a.slug, (None, None))
-                        if value:
-                            break
-                    if value:
-                        break
-                    else:
-                        number_of_real_messages -= 1
+        renderer = SignSummaryRenderer()
+        html = renderer.message_html(self, self.attributes())
+        result = (html, renderer.colors)
 
-                if number_of_real_messages != 0:
-                    html += "<table class='attributes_repeating_table'><thead><tr>"
-                    for a in attributes_repeating:
-                        html += "<th>"+unicode(a)+"</th>"
-                    html += "</tr></thead><tbody>"
+        if self.id:
+            derived_set("sign_message_summary", self.id, signature, result)
+        return result
 
-                    side_dict = self.sign_template.side_dict()
-                    column_dict = self.sign_template.column_dict()
-                    for k in range(number_of_real_messages):
-                        side_num = side_dict.get(k, None)
-                        column_num = column_dict.get(k, None)
-                        if side_num:
-                            html += '<tr class="tr_side_number_expanded_list">'
-                            html += '<td colspan="{0}"><b>Side {1}</b></td>'.format(attributes_repeating_count, side_num)
-                            html += '</tr>'
-                        if column_num:
-                            html += '<tr class="tr_column_number_expanded_list">'
-                            html += '<td colspan="{0}">Column {1}</td>'.format(attributes_repeating_count, column_num)
-                            html += '</tr>'
+    def meta_html(self):
+        """ Used to show a brief summary of message info for sign hover and expanded list view """
+        html, colors = self.meta_html_parts()
+        return color_css(colors) + html
 
-                        html += "<tr>"
-                        message = message_list[k]
-                        # TODO: if performance is an issue, use the following
-                        # message_dict = message.attribute_instances_dict()
-                        message_dict = {}
-                        attribute_instances_text_dict = message.attribute_instances_text_dict()
-                        for ai in message.attribute_instances.all():
-                            message_dict[ai.attribute.id] = ai.value()
+    def meta_html_parts(self):
+        """ meta_html without the color css, returns (html, list of colors used) """
+        if self.id:
+            result, signature = derived_get("sign_meta_summary", self)
+            if result is not None:
+                return result
 
-                        for a in attributes_repeating:
-                            try:
-                                value = message_dict[a.id]
-                            except KeyError:
-                                value = ""
-                            if not value:
-                                value = ""
-                            if a.field_type == "color":
-                                value = escape(value)
-                                html += """<style>
-                                            @media all{
-                                            td.color_"""+value+"""{
-                                                background-color: #"""+value+""" !important;
-                                                color: #"""+font_color(value)+""" !important;
-                                                padding: 3px !important;
-                                                }
-                                            }
-                                        </style>"""
-                                html += "<td class='color_"+value+"'>"+value+"</td>"
-                            elif a.field_type in ["color_x",'color_t']:
-                                # color = Color.objects.get(id=value)
-                                if value:
-                                    html += """<style>
-                                                @media all{
-                                                td.color_"""+value.color+"""{
-                                                    background-color: #"""+value.color+""" !important;
-                                                    color: #"""+font_color(value.color)+""" !important;
-                                                    padding: 3px !important;
-                                                    }
-                                                }
-                                            </style>"""
-                                    html += "<td class='color_"+value.color+"'>"+value.name+"</td>"
-                                else:
-                                    html += "<td></td>"
-                            elif a.field_type in ["icon",'icon_t']:
-                                if value:
-                                    unused_value, source, text_value = attribute_instances_text_dict.get(a.slug, ('',None, ''))
-                                    html += "<td style='text-align:center'><img height='15px' src='/sign_message/icon/"+str(value.id)+"/thumbnail_url/40/' alt='"+text_value+"'></td>"
-                                else:
-                                    html += "<td></td>"
-                            else:
-                                if not value:
-                                    value = "\n"
-                                html += "<td>"+linebreaksbr(escape(value))+"</td>"
-                        html += "</tr>"
-                    html += "</tbody></table>"
+        renderer = SignSummaryRenderer()
+        html = renderer.meta_html(self)
+        result = (html, renderer.colors)
 
         if self.id:
-            cache.set(key, html, None)      # invalidation happens at the sign_template, and attribute level
-        return html
-
-    def meta_html(self):
-        """ Used to show a brief summary of message info for sign hover and expanded list view """
-        html = ""
-        if self.sign_template:
-            attributes_meta = self.sign_template.meta_attributes()
-            aid = self.attribute_instances_dict()
-            aid_text = self.attribute_instances_text_dict()
-            for a in attributes_meta:
-                value = aid.get(a.slug, ('',None))[0]
-                if value and value != '-unknown-':
-                    value = escape(value)
-                    html += "<b>"+unicode(a)+"</b>"
-                    if a.field_type == "color":
-                        html += """<style>
-                                    @media all{
-                                    .color_"""+value+"""{
-                                        background-color: #"""+value+""" !important;
-                                        color: #"""+font_color(value)+""" !important;
-                                        padding: 3px !important;
-                                        }
-                                    }
-                                </style>"""
-                        html += "<p class='color_"+value+"'>"+value+"</p>"
-                    elif a.field_type in ["color_x",'color_t']:
-                        color = Color.objects.get(id=value)
-                        html += """<style>
-                                    @media all{
-                                    .color_"""+color.color+"""{
-                                        background-color: #"""+color.color+""" !important;
-                                        color: #"""+font_color(color.color)+""" !important;
-                                        padding: 3px !important;
-                                        }
-                                    }
-                                </style>"""
-                        html += "<p class='color_"+color.color+"'>"+color.name+"</p>"
-                    elif a.field_type in ["icon",'icon_t']:
-                        unused_value, source, text_value = aid_text.get(a.slug, ('',None,''))
-                        html += "<p><img height='15px' src='/sign_message/icon/"+value+"/thumbnail_url/40/' alt='"+text_value+"'></p>"
-                    else:
-                        html += "<p>"+linebreaksbr(value)+"</p>"
-        return html
+            derived_set("sign_meta_summary", self.id, signature, result)
+        return result
 
     def message_html_for_api(self):
         """ Sebastian wants None instead of empty strings """
@@ -955,8 +902,7 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
 
         if self.sign_template:
             # for a in self.sign_template.required_attributes.all():
-            for sta in self.sign_template.sign_template_attributes.filter(is_repeating=False, attribute__group='message'):
-                a = sta.attribute
+            for a in self.compiled_template().svg_attributes:
                 d[a.slug] = a.prep_for_svg(d[a.slug])
         return d
 
@@ -973,11 +919,12 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
             local attributes
         """
         if self.id:
-            key = "sign_unicode:%s" % self.id
-            result = cache.get(key)
+            result, signature = derived_get("sign_unicode", self)
             if result:
-                # decode allows for ascii characters like bullets
-                return result.decode('utf-8')
+                if isinstance(result, bytes):
+                    # decode allows for ascii characters like bullets
+                    return result.decode('utf-8')
+                return result
 
         if not self.sign_template or not self.zone:
             return "New Sign"
@@ -1004,7 +951,7 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
         result = template.format(**kwargs)
 
         if self.id:
-            cache.set(key, result, None)      # invalidation happens at the sign_template, and attribute level
+            derived_set("sign_unicode", self.id, signature, result)
         return result
 
     def get_absolute_url(self):
@@ -1012,34 +959,82 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
         return reverse_lazy("sign:update", kwargs={'pk':self.id})
 
     def get_svg_url(self, generate=True):
-        """ used in the form, where we want absolutely zero caching """
+        """ The svg_as_png url. It's versioned by svg_fingerprint, so it only changes (and the browser only
+            downloads it again) when the artwork can have changed
+        """
         if not hasattr(self, '_get_svg_url'):
             # url = reverse_lazy("sign:svg", kwargs={'pk':self.id}) + "?t={0}".format(time.time())
-            url = reverse_lazy("sign:svg_as_png", kwargs={'pk':self.id}) + "?t={0}&generate={1}".format(time.time(), generate)
+            fingerprint = self.svg_fingerprint()
+            if fingerprint:
+                url = reverse_lazy("sign:svg_as_png", kwargs={'pk':self.id}) + "?v={0}&generate={1}".format(fingerprint, generate)
+            else:
+                url = reverse_lazy("sign:svg_as_png", kwargs={'pk':self.id}) + "?generate={0}".format(generate)
             self._get_svg_url = url
         return self._get_svg_url
 
     def get_pdf_url(self):
-        """ used in the form, where we want absolutely zero caching """
+        """ The pdf_as_png url, versioned by pdf_fingerprint """
         if not hasattr(self, '_get_pdf_url'):
             # url = reverse_lazy("sign:svg", kwargs={'pk':self.id}) + "?t={0}".format(time.time())
-            url = reverse_lazy("sign:pdf_as_png", kwargs={'pk':self.id}) + "?t={0}".format(time.time())
+            url = reverse_lazy("sign:pdf_as_png", kwargs={'pk':self.id}) + "?v={0}".format(self.pdf_fingerprint())
             self._get_pdf_url = url
         return self._get_pdf_url
 
     def get_artwork_url(self):
-        """ used in the api to fetch either the svg_as_png or the pdf_as_png """
+        """ used in the api to fetch either the svg_as_png or the pdf_as_png (versioned like get_svg_url) """
         if self.id and (self.override_pdf or (self.sign_template and self.sign_template.svg_code)):
-            url = reverse_lazy("sign:artwork", kwargs={'pk':self.id}) + "?t={0}".format(time.time())
+            if self.override_pdf:
+                fingerprint = self.pdf_fingerprint()
+            else:
+                fingerprint = self.svg_fingerprint()
+            url = reverse_lazy("sign:artwork", kwargs={'pk':self.id})
+            if fingerprint:
+                url += "?v={0}".format(fingerprint)
             return url
         return None
 
+    def svg_fingerprint(self):
+        """ A short hash of everything the svg_as_png is rendered from: the generations it depends on
+            (see derived_get_many) and node's renderer version. (see prefetch_svg_fingerprints for a list of signs)
+            None while we don't know node's version.
+        """
+        if not hasattr(self, '_svg_fingerprint'):
+            prefetch_svg_fingerprints([self])
+        return self._svg_fingerprint
+
+    def pdf_fingerprint(self):
+        """ A short hash of the override pdf and its previews (which change name whenever they are regenerated) """
+        return hashlib.sha1(u"{0}:{1}".format(self.override_pdf.name or "", self.override_pdf_as_png.name or "").encode('utf-8')).hexdigest()[:16]
+
+    def svg_as_png_etag(self):
+        """ strong ETag of the current svg_as_png (the png is content-addressed), None until it's generated """
+        if not self.id:
+            return None
+        name, signature = self._stored_png_name()
+        if not name:
+            return None
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def pdf_as_png_etag(self, size="detail"):
+        """ strong ETag of an override pdf preview, None until it's generated """
+        name = self.override_preview_name(size)
+        if name is None:
+            return None
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def artwork_etag(self):
+        """ ETag for the artwork endpoint, which serves either the pdf_as_png or the svg_as_png """
+        if self.override_pdf:
+            return self.pdf_as_png_etag()
+        return self.svg_as_png_etag()
+
     def position_index_number(self):
         """ return the index of this sign in the list of signs for this position """
         return list(self.position.signs.all().values_list('id', flat=True)).index(self.id) + 1
 
     @staticmethod
     def myreplace(haystack, needle, replacement):
+        """ replace `{needle}` and `{ needle }`. To substitute many values, use SvgTemplate """
         if replacement is None:
             replacement = ''
         new = haystack.replace(u"{%s}" % needle, replacement)
@@ -1049,6 +1044,7 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
     def svg_context(self, text_to_vector=False):
         """ create a context dictionary for Bill's svg rendering code. """
         attribute_dict = self.attributes()
+        compiled = self.compiled_template()
         context = {
             'number': self.number,
             'type.short_code_combo': attribute_dict.get('type.short_code_combo'),
@@ -1061,20 +1057,17 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
             'svg_options': {
                 'text_to_vector': text_to_vector,
                 'embed_svg': True,
-                'fonts_list': self.sign_template.fonts_list(),
+                'fonts_list': compiled.fonts_list,
             },
         }
         if self.sign_template and self.sign_template.svg_code:
-            for sta in self.sign_template.sign_template_attributes.filter(is_repeating=False, attribute__group='message'):
-                a = sta.attribute
+            for a in compiled.svg_attributes:
                 v = attribute_dict.get(a.slug, ('', None))[0]
                 dv = a.prep_for_dynamic_svg(v)
                 if dv:
                     context[a.slug] = dv
 
-            repeating_attributes = []
-            for sta in self.sign_template.sign_template_attributes.filter(is_repeating=True):
-                repeating_attributes.append(sta.attribute)
+            repeating_attributes = compiled.repeating_attributes
 
             rows = []
             for i, m in enumerate(self.sign_messages.all()):
@@ -1109,9 +1102,9 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
             #     }
             # }
 
-            num_sides = int(self.sign_template.number_of_sides)
-            num_cols = self.sign_template.number_of_columns
-            num_messages = self.sign_template.number_of_messages
+            num_sides = compiled.number_of_sides
+            num_cols = compiled.number_of_columns
+            num_messages = compiled.number_of_messages
             for i in range(num_sides):
                 side_num = i + 1     # start counting at 1, rather than 0, because there are humans involved.
                 side_key = "side_{0}".format(side_num)
@@ -1139,8 +1132,9 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
 
     def svg_node_payload(self, text_to_vector=False):
         return {
-            'json_data': "base64:" + base64.b64encode(json.dumps(self.svg_context(text_to_vector=text_to_vector), indent=4)),
-            'svg_template': "base64:" + base64.b64encode(self.sign_template.svg_code_w_fonts()),
+            # sort_keys keeps the payload (and therefore the render cache key) stable
+            'json_data': "base64:" + base64.b64encode(json.dumps(self.svg_context(text_to_vector=text_to_vector), indent=4, sort_keys=True)),
+            'svg_template': "base64:" + base64.b64encode(self.compiled_template().svg_template),
             }
 
     def svg_code_text_to_vector(self):
@@ -1151,80 +1145,51 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
             return self._svg_code
 
         if self.sign_template and self.sign_template.svg_code:
-            template = self.sign_template.svg_code_w_fonts()
+            compiled = self.compiled_template()
+            expanded = None
 
             # determine which 'spec' we are using. Bill's comprehensive `<g id='level'>`, or Aaron's simplified `{level}`?
-
-            use_expander = False
-            # look for a tag with `id='repeat'`
-            p = re.compile(r"<g .*?id\w*?=\w*?('|\")repeat('|\").*?>")
-            if p.search(template):
-                use_expander = True
-            else:
-                for k in self.attributes().keys():
-                    # look for g tags like `id='level'`
-                    p = re.compile(r"<g .*?id\w*?=\w*?('|\")%s('|\").*?>" % k)
-                    if p.search(template):
-                        use_expander = True
-                        break
-
-            if use_expander:
+            # (this is worked out once per template version, see CompiledSignTemplate)
+            if compiled.use_expander:
                 # it's a dynamic template
 
                 # make a call to localhost:8081/expand/, with data json_data and svg_template
                 payload = self.svg_node_payload(text_to_vector=text_to_vector)
                 # ...unless of course we've done this exact same work before.
-                # note: is this worth caching? We wrap this function in a conversion to png almost all the time, so this cacheing really just helps when a user is reverting their changes back to a prevoious state, or they have several signs with identical content.
-
-                # removed caching because it doesnt get invalidated when Node updates
-                # payload_hash = hashlib.md5(json.dumps(payload)).hexdigest()
-                # result = cache.get(payload_hash)
-                result = False
+                # This helps when a user is reverting their changes back to a previous state, or they have several signs with identical content.
+                # The key includes node's renderer version, so a node upgrade invalidates it.
+                payload_name = render_content_name("expand", json.dumps(payload, sort_keys=True))
+                result = artwork_store().get(payload_name) if payload_name else None
                 if result:
-                    template = result
+                    expanded = result.decode('utf-8')
                 else:
+                    # a NodeRenderError (node is down, or failing) is left to the caller
                     try:
-                        url = "{0}/expand/".format(settings.NODE_DOMAIN)
-                        with requests.post(url, data=payload, headers=settings.NODE_HEADERS) as r:
-                            r_text = r.text
-                    except:
-                        # fail gracefully, at least for now
-                        # pass
-                        raise
+                        expanded = node_render("expand", payload).text
+                    except MalformedArtwork:
+                        # when text is very short.. it's probably an empty svg document, which is the result of some sort of error in Bill's expansion code.
+                        # (most likely a malformed template, node itself failing is a NodeRenderError). We fall back to the template as is.
+                        pass
                     else:
-                        if len(r_text) > 150:
-                            template = r_text
-                            # cache.set(payload_hash, template, 604800)
+                        if payload_name:
+                            artwork_store().put(payload_name, expanded.encode('utf-8'))
 
-                        else:
-                            # when text is very short.. it's probably an empty svg document, which is the result of some sort of error in Bill's expansion code.
-
-                            # it would be nice to know whether this error is because of a flaw in the node logic (developer-error), or whether the svg template is malformed (user-error). Currently, there's no way for us to know.
-                            # if it's a developer-error, we'd want to raise an exception here, with additional context to debug and resolve.
-                            # if it's a user-error, we'd want to return the failure to the user, probably using a placeholder image with text saying "Artwork generation failed, your template appears to be malformed".
-                            # both of these options would be better served by node. That is to say: Node should be raising an error and logging to sentry itself, or returning a placeholder image in the case of a malformed template. It would then be djano's responsibility (here) to raise an exception when node returns an unexpected result for any other (developer-related) reason.
-                            pass
-                            # raise Exception("The node expansion appears to have returned an invalid response: '{0}'".format(r_text))
-                            # Todo:
-                            # create place holder indicating failed artwork
 
+            if expanded is None:
+                # the template as is, already parsed
+                svg_template = compiled.static_template()
+            else:
+                svg_template = SvgTemplate(svg_ascii(expanded))
 
-            # This is a fix to funny characters like the "e" with the thingy on top
-            # This may have un-intended effect for certain edge case characters
-            if type(template) == type(str()):
-                template = unicode(template, "utf-8", errors="ignore")
-            template = template.encode('ascii', 'xmlcharrefreplace')
-            if "{" in template or "}" in template:
+            template = svg_template.text
+            if svg_template.placeholders:
                 # it's a static/fixed template
 
-                # inject attribute values for attributes
-                for k,v in self.attributes_prepped_for_svg().items():
-                    template = self.myreplace(template, k, v)
+                # attribute values for attributes
+                values = self.attributes_prepped_for_svg()
 
-                # inject attribute values for repeating attributes
-                repeating_attributes = []
-                for sta in self.sign_template.sign_template_attributes.filter(is_repeating=True):
-                    repeating_attributes.append(sta.attribute)
+                # attribute values for repeating attributes
+                repeating_attributes = compiled.repeating_attributes
                 for i, m in enumerate(self.sign_messages.all()):
                     prefixes = ["message_%s" % (i+1)]
                     if i == 0:
@@ -1235,7 +1200,10 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
                         value = a.prep_for_svg(value)
                         for prefix in prefixes:
                             field_key = "{0}.{1}".format(prefix, a.slug)
-                            template = self.myreplace(template, field_key, value)
+                            values[field_key] = value
+
+                # inject them all in one pass
+                template = svg_template.render(values)
 
             result = mark_safe(template)
 
@@ -1253,7 +1221,7 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
         svg = get_first_svg_in_lxml(root)
         return etree.tostring(svg, pretty_print=True)
 
-    def svg_as_png(self, generate=True):
+    def svg_as_png(self, generate=True, fallback=True):
         """ get the node server to render the svg into a png
 
             We used to pass the svg_code directly to Node, but that ran us into text encoding headaches (specifically: with the url encoding of font urls within the stylesheet)
@@ -1264,44 +1232,165 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
                 which asks django for /<id>/svg/
                 which asks node for /expand/
                 which asks node for /_expand/
+
+            With settings.SIGN_PNG_RENDER_MODE = "direct", we send node the (base64 encoded, to side step
+            the encoding headaches) svg we've already expanded instead of the svg_url. That is a single call
+            to node, which never has to come back into our own request pool.
+
+            When node fails (see node_render), the "generating" placeholder is returned and nothing is stored.
+            With fallback=False the RenderError is raised instead (the artwork job wants to know).
         """
-        if self.id:
-            key = "sign_svg_as_png:%s" % self.id
-            result = cache.get(key)
+        if not self.id:
+            try:
+                with render_slot(self.project_id):
+                    return self._render_svg_as_png(None)
+            except RenderError:
+                if not fallback:
+                    raise
+                return generating_artwork_placeholder()
+
+        result, signature = self._stored_svg_as_png()
+        if result:
+            return result
+        elif generate==False:
+            # return an 'in progress' placeholder, and make sure it's being processed somewhere
+            # (an inherited attribute change leaves the png stale without a job of its own)
+            request_artwork([self.id])
+            return generating_artwork_placeholder()
+
+        # only one render of a sign at a time (eg. a list page loading while the artwork job runs).
+        # everyone else waits for it, briefly
+        lock = "sign:%s" % self.id
+        if render_lock_held(lock):
+            return self._wait_for_svg_as_png(lock)
+        try:
+            # the render slot is taken before the sign's lock, so the lock isn't held (and can't expire)
+            # while we queue for a slot
+            with render_slot(self.project_id):
+                # it may have been rendered while we waited for the slot
+                result, signature = self._stored_svg_as_png()
+                if result:
+                    return result
+                token = acquire_render_lock(lock)
+                if token is None:
+                    return self._wait_for_svg_as_png(lock)
+                try:
+                    return self._render_svg_as_png(signature)
+                finally:
+                    release_render_lock(lock, token)
+        except RenderError:
+            if not fallback:
+                raise
+            return generating_artwork_placeholder()
+
+    def _wait_for_svg_as_png(self, lock):
+        """ wait for someone else's render of our png, or give up with the placeholder """
+        if wait_for_render_lock(lock):
+            result, signature = self._stored_svg_as_png()
             if result:
                 return result
-            elif generate==False:
-                # return an 'in progress' placeholder (and hope that this is being processed somewhere.)
-                with open("{0}/sign/static/sign/generating_artwork.png".format(settings.BASE_DIR)) as f:
-                    content = f.read()
-                return content
-
-        # x,y = get_dimensions_of_svg(self.sign_template.svg_code)
-        x,y = get_dimensions_of_svg(self.svg_code())
+        return generating_artwork_placeholder()
+
+    def _stored_png_name(self):
+        """ returns (the artwork store name of the current png or None, signature for derived_set).
+            A png rendered by an older node (see render_name_is_current) isn't current.
+        """
+        # the cache only holds the name of the png in the artwork store
+        name, signature = derived_get("sign_svg_as_png", self)
+        if name and not render_name_is_current(name):
+            name = None
+        return name, signature
+
+    def _stored_svg_as_png(self):
+        """ returns (the current png or None, signature for derived_set) """
+        name, signature = self._stored_png_name()
+        result = artwork_store().get(name) if name else None
+        return result, signature
+
+    def _render_svg_as_png(self, signature):
+        """ svg_as_png, once we know that the sign's png isn't stored """
+        svg_code = self.svg_code()
+        # the expansion doesn't change the dimensions, so use the ones worked out for the template
+        compiled = self.compiled_template()
+        if compiled and compiled.width is not None:
+            x, y = compiled.width, compiled.height
+        else:
+            x, y = get_dimensions_of_svg(svg_code)
+
+        # signs with identical artwork share one png
+        content_name = render_content_name("png", u"{0}x{1}:{2}".format(x, y, svg_code))
+        content_lock = token = None
+        if content_name:
+            result = artwork_store().get(content_name)
+            if not result:
+                # and only one render of identical artwork
+                content_lock = "png:%s" % content_name.rsplit("/", 1)[1]
+                token = acquire_render_lock(content_lock)
+                if token is None:
+                    if wait_for_render_lock(content_lock):
+                        result = artwork_store().get(content_name)
+                    if not result:
+                        return generating_artwork_placeholder()
+            if result:
+                if self.id:
+                    derived_set("sign_svg_as_png", self.id, signature, content_name)
+                return result
+
+        try:
+            return self._convert_png(svg_code, x, y, content_name, signature)
+        finally:
+            if token:
+                release_render_lock(content_lock, token)
+
+    def _convert_png(self, svg_code, x, y, content_name, signature):
+        """ have node render the png, and store it """
         payload = {
             'width': x,
             'height': y,
-            'svg_url': settings.DOMAIN + reverse("sign:svg", kwargs={'pk':self.id}) + "?direct=1",
             }
-        url = "{0}/convert_png/".format(settings.NODE_DOMAIN)
-        with requests.post(url, data=payload, headers=settings.NODE_HEADERS) as r:
-            r_content = r.content
-
-        if self.id:
-            if len(r_content) > 150:
-                # we don't want to cache an error.
-                # be mindful that this logic has consequences. If the error is expensive, then not caching it will add to the work on our server.
-                cache.set(key, r_content, None)      # invalidation happens at the sign_template, and attribute level
+        if getattr(settings, 'SIGN_PNG_RENDER_MODE', "callback") == "direct":
+            if isinstance(svg_code, unicode):
+                svg_code = svg_code.encode('utf-8')
+            payload['svg_code'] = "base64:" + base64.b64encode(svg_code)
+        else:
+            payload['svg_url'] = settings.DOMAIN + reverse("sign:svg", kwargs={'pk':self.id}) + "?direct=1"
+        # errors and malformed results are raised, so they are never stored
+        r_content = node_render("convert_png", payload).content
+
+        if content_name:
+            artwork_store().put(content_name, r_content)
+            if self.id:
+                derived_set("sign_svg_as_png", self.id, signature, content_name)
+        elif self.id:
+            # without node's renderer version the png can't be shared between signs, but this sign can
+            # still keep it (until its generations change, or node tells us its version again)
+            digest = hashlib.sha1(r_content).hexdigest()
+            name = "png/sign/{0}/{1}".format(self.id, digest)
+            artwork_store().put(name, r_content)
+            derived_set("sign_svg_as_png", self.id, signature, name)
         return r_content
 
+    def svg_as_png_path(self):
+        """ The local file of the current png (see svg_as_png), for a view to hand to sendfile rather than
+            reading it through python. None when it hasn't been generated, or isn't on the local filesystem.
+        """
+        if not self.id:
+            return None
+        name, signature = self._stored_png_name()
+        if not name:
+            return None
+        return artwork_store().path(name)
+
     def svg_debug_code(self):
         payload = self.svg_node_payload()
         s1 = "<form action='http://localhost:8081/expand/' method='post'><input type='hidden' name='json_data' value='{json_data}'><input type='hidden' name='svg_template' value='{svg_template}'><input type='submit' value='render via node (puppeteer)'></form>".format(**payload)
         s2 = "<form action='http://localhost:8081/_expand/' method='post'><input type='hidden' name='json_data' value='{json_data}'><input type='hidden' name='svg_template' value='{svg_template}'><input type='submit' value='render in the browser'></form>".format(**payload)
         return s1 + s2
 
-    def snapshot(self):
-        """ take a json snapshot of the sign, including tags, messaging, and local attributes """
+    def snapshot(self, attributes_repeating=None):
+        """ take a json snapshot of the sign, including tags, messaging, and local attributes
+            (`attributes_repeating` can be passed in when snapshotting many signs, see iter_snapshots)
+        """
         if self.override_pdf:
             custom_artwork = "<a href='{0}'>{1}</a>".format(self.override_pdf.url, unicode(self.override_pdf).rsplit("/",1)[1])
         else:
@@ -1320,12 +1409,8 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
             data['tags'] = ", ".join([unicode(t) for t in self.tags.all()])
 
             # repeating attributes
-            attributes_repeating = Attribute.objects.filter(
-                                    is_inheritable=False,
-                                    group="message",
-                                    sign_template_attributes__is_repeating=True,
-                                    sign_template_attributes__sign_template=self.sign_template
-                                    ).order_by('sign_template_attributes')
+            if attributes_repeating is None:
+                attributes_repeating = snapshot_repeating_attributes(self.sign_template_id)
             for i, m in enumerate(self.sign_messages.all()):
                 message_dict = {}
                 for k, v in m.attribute_instances_text_dict().items():
@@ -1345,8 +1430,9 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
 
         return data
 
-    def auto_set_number(self, **kwargs):
+    def auto_set_number(self, reserve=True, **kwargs):
         # set number, based on auto_numbering rules
+        # reserve=False only suggests the next number (eg. to prefill a form), without using it up
         if self.project_id:
             project = self.project
         elif 'zone' in kwargs:
@@ -1357,58 +1443,1422 @@ class Sign(ApiSyncInfoMixin, ConversationMixin, ModelWithAttributes):
         if auto_numbering != "0":
             cd_zone = kwargs.get('zone', self.zone)
             cd_type = kwargs.get('sign_template', self.sign_template)
-            if auto_numbering == "1":
-                key = "zone_%s:max_sign_number" % cd_zone.id
-            elif auto_numbering == "2":
-                key = "zone_{0},type_{1}:max_sign_number".format(cd_zone.id, cd_type.id)
-            elif auto_numbering == "3":
-                key = "type_%s:max_sign_number" % cd_type.id
-
-            largest = cache.get(key)
-            if not largest:
-                # long form logic to determine this value
-                largest = 0
-                char_length = 0
-                if auto_numbering == "1":
-                    max_sign_number_qs = cd_zone.signs.all()
-                elif auto_numbering == "2":
-                    max_sign_number_qs = cd_zone.signs.filter(sign_template=cd_type)
-                elif auto_numbering == "3":
-                    max_sign_number_qs = cd_type.signs.all()
-
-                for s in max_sign_number_qs:
-                    try:
-                        v = int(s.number)
-                    except ValueError:
-                        v = 0
-                    if v > largest:
-                        largest = v
-                        char_length = len(s.number)
-                largest = str(largest).zfill(char_length)
-                cache.set(key, largest, None)
-            value = str(int(largest)+1).zfill(len(largest))
-            self.number = value
+            if reserve:
+                self.number = reserve_sign_numbers(project, cd_zone, cd_type, 1)[0]
+            else:
+                self.number = next_sign_number(project, cd_zone, cd_type)
+
+class SignNumberSequence(models.Model):
+    """ The last number handed out within an auto numbering scope (see sign_number_scope) """
+    scope = models.CharField(max_length=255, unique=True)
+    last_value = models.BigIntegerField(default=0)
+    width = models.PositiveSmallIntegerField(default=1, help_text="numbers are zero padded to this width")
+
+class SignSearchTerm(models.Model):
+    """ The sign search index, maintained by reindex_signs().
+        One row per term found in a sign's number, label, tags, and local and repeating message
+        attribute values. Each term is also stored as its suffixes (offset > 0), so that a prefix
+        lookup on the indexed `term` column finds substrings as well.
+    """
+    sign = models.ForeignKey(Sign, related_name="search_terms", on_delete=models.CASCADE)
+    project = models.ForeignKey("sign_project.Project", related_name="+", on_delete=models.CASCADE)
+    term = models.CharField(max_length=64, db_index=True)
+    offset = models.PositiveSmallIntegerField(default=0, help_text="0 for the whole term, otherwise the start of this suffix")
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        index_together = (('project', 'term'),)
+
+def sign_number_scope(project, zone, sign_template):
+    """ return the name, and queryset, of the signs that share a numbering sequence (following project.auto_numbering) """
+    auto_numbering = project.auto_numbering
+    if auto_numbering == "1":
+        return "zone_%s" % zone.id, zone.signs.all()
+    elif auto_numbering == "2":
+        return "zone_{0},type_{1}".format(zone.id, sign_template.id), zone.signs.filter(sign_template=sign_template)
+    elif auto_numbering == "3":
+        return "type_%s" % sign_template.id, sign_template.signs.all()
+    raise Exception('project does not use auto numbering')
+
+def largest_sign_number(max_sign_number_qs):
+    """ return the largest integer number in a queryset of signs, and its zero padded width.
+        (a single aggregate query, non integer numbers are ignored)
+    """
+    number = max_sign_number_qs.filter(number__regex=r'^[0-9]{1,18}$').annotate(
+                number_value=Cast('number', models.BigIntegerField())
+                ).order_by('-number_value').values_list('number', flat=True).first()
+    if number is None:
+        return 0, 1
+    return int(number), len(number)
+
+def reserve_sign_numbers(project, zone, sign_template, count):
+    """ Atomically reserve `count` consecutive numbers in a numbering scope, and return them zero padded.
+        The scope's sequence is seeded from the largest number already in use.
+        The sequence row stays locked until the caller's transaction ends, so call this before (not within)
+        any long transaction, or every other creator in the scope waits for it.
+    """
+    scope, max_sign_number_qs = sign_number_scope(project, zone, sign_template)
+    with transaction.atomic():
+        sequence = SignNumberSequence.objects.select_for_update().filter(scope=scope).first()
+        if sequence is None:
+            last_value, width = largest_sign_number(max_sign_number_qs)
+            try:
+                with transaction.atomic():
+                    sequence = SignNumberSequence.objects.create(scope=scope, last_value=last_value, width=width)
+            except IntegrityError:
+                # someone else seeded it first
+                sequence = SignNumberSequence.objects.select_for_update().get(scope=scope)
+        first = sequence.last_value + 1
+        SignNumberSequence.objects.filter(id=sequence.id).update(last_value=models.F('last_value') + count)
+    return [str(value).zfill(sequence.width) for value in range(first, first + count)]
+
+def next_sign_number(project, zone, sign_template):
+    """ The number reserve_sign_numbers would hand out next in a numbering scope, without reserving it """
+    scope, max_sign_number_qs = sign_number_scope(project, zone, sign_template)
+    sequence = SignNumberSequence.objects.filter(scope=scope).first()
+    if sequence is None:
+        last_value, width = largest_sign_number(max_sign_number_qs)
+    else:
+        last_value, width = sequence.last_value, sequence.width
+    return str(last_value + 1).zfill(width)
+
+def advance_sign_number_sequences(signs):
+    """ When numbers are typed in (or imported), move their scopes' sequences past them (if they have been seeded) """
+    largest = {}
+    for sign in signs:
+        project = sign.project
+        if project.auto_numbering == "0" or not re.match(r'^[0-9]{1,18}$', sign.number):
+            continue
+        if (project.auto_numbering in ("1", "2") and not sign.zone_id) or (project.auto_numbering in ("2", "3") and not sign.sign_template_id):
+            continue
+        scope, unused_qs = sign_number_scope(project, sign.zone, sign.sign_template)
+        if int(sign.number) > largest.get(scope, (-1, ""))[0]:
+            largest[scope] = (int(sign.number), sign.number)
+    for scope, (value, number) in largest.items():
+        SignNumberSequence.objects.filter(scope=scope, last_value__lt=value).update(last_value=value, width=len(number))
+
+def _copy_instance(obj, **changes):
+    """ returns an unsaved copy of a model instance (its concrete fields, without the id or any cached relations) """
+    values = dict((field.attname, getattr(obj, field.attname)) for field in obj._meta.concrete_fields if not field.primary_key)
+    copy = obj.__class__(**values)
+    for name, value in changes.items():
+        setattr(copy, name, value)
+    return copy
+
+def _bulk_create_mixed(objs, batch_size):
+    """ bulk_create a list of (unsaved) objects, which may be of different models """
+    by_model = OrderedDict()
+    for obj in objs:
+        by_model.setdefault(obj.__class__, []).append(obj)
+    for model, model_objs in by_model.items():
+        model.objects.bulk_create(model_objs, batch_size=batch_size)
+
+def state_perms(state):
+    """ return the (codename, group) object permissions that a sign in `state` is given on itself, and on its position """
+    phase_member_group = state.phase.get_member_group()
+    phase_viewer_group = state.phase.get_viewer_group()
+    state_viewer_group = state.get_viewer_group()
+    sign_perms = [
+        ('change_sign', phase_member_group),
+        ('view_sign', phase_member_group),
+        ('view_sign', phase_viewer_group),
+        ('view_sign', state_viewer_group),
+        ('review_sign', state_viewer_group),
+    ]
+    position_perms = [
+        ('change_position', phase_member_group),
+        ('view_position', phase_member_group),
+        ('view_position', phase_viewer_group),
+        ('view_position', state_viewer_group),
+    ]
+    return sign_perms, position_perms
+
+def sign_state_perms(signs, states=None, perms_by_state=None):
+    """ return the set of (codename, group, model, object_pk) object permissions granted by the signs' states
+        `states` optionally overrides the state of each sign (eg. the state a sign is leaving)
+    """
+    if states is None:
+        states = [sign.state for sign in signs]
+    if perms_by_state is None:
+        perms_by_state = {}
+    perms = set()
+    for sign, state in zip(signs, states):
+        if state is None:
+            continue
+        if state.id not in perms_by_state:
+            perms_by_state[state.id] = state_perms(state)
+        sign_perms, position_perms = perms_by_state[state.id]
+        for codename, group in sign_perms:
+            perms.add((codename, group, Sign, sign.pk))
+        for codename, group in position_perms:
+            perms.add((codename, group, Position, sign.position_id))
+    return perms
+
+def reassign_state_perms(moves, batch_size=500):
+    """ Move the object permissions of signs (and their positions) from one state to another.
+            `moves` is a list of (sign, old_state), where sign.state is the new state.
+
+        The permission delta is worked out as set operations, then written with bulk deletes and inserts.
+        A position keeps a permission as long as any of its signs still grants it.
+    """
+    perms_by_state = {}
+    signs = [sign for sign, old_state in moves]
+    old_perms = sign_state_perms(signs, [old_state for sign, old_state in moves], perms_by_state)
+    new_perms = sign_state_perms(signs, perms_by_state=perms_by_state)
+
+    other_signs = list(Sign.objects.filter(
+                            position_id__in=set(sign.position_id for sign in signs),
+                            state__isnull=False,
+                            ).exclude(id__in=[sign.pk for sign in signs]).select_related('state__phase'))
+    kept_perms = new_perms | sign_state_perms(other_signs, perms_by_state=perms_by_state)
+
+    with transaction.atomic():
+        bulk_remove_perms(old_perms - kept_perms, batch_size=batch_size)
+        bulk_assign_perms(new_perms, batch_size=batch_size)
+
+def _permission_lookup(perms):
+    """ return {(model, codename): Permission} for a set of (codename, group, model, object_pk) """
+    lookup = {}
+    for model in set(p[2] for p in perms):
+        ct = ContentType.objects.get_for_model(model)
+        codenames = set(p[0] for p in perms if p[2] is model)
+        for permission in Permission.objects.filter(content_type=ct, codename__in=codenames):
+            lookup[(model, permission.codename)] = permission
+    return lookup
+
+def _group_perms(perms):
+    """ return {(Permission, group): set of object_pks} for a set of (codename, group, model, object_pk) """
+    permissions = _permission_lookup(perms)
+    grouped = OrderedDict()
+    for codename, group, model, object_pk in perms:
+        grouped.setdefault((permissions[(model, codename)], group), set()).add(unicode(object_pk))
+    return grouped
+
+def bulk_assign_perms(perms, batch_size=500):
+    """ The bulk version of guardian's assign_perm.
+        `perms` is a set of (codename, group, model, object_pk). Rows that already exist are left alone.
+    """
+    new_rows = []
+    for (permission, group), object_pks in _group_perms(perms).items():
+        existing = set(GroupObjectPermission.objects.filter(
+                            permission=permission,
+                            group=group,
+                            content_type=permission.content_type,
+                            object_pk__in=object_pks,
+                            ).values_list('object_pk', flat=True))
+        for object_pk in object_pks - existing:
+            new_rows.append(GroupObjectPermission(permission=permission, group=group, content_type=permission.content_type, object_pk=object_pk))
+    GroupObjectPermission.objects.bulk_create(new_rows, batch_size=batch_size)
+
+def bulk_remove_perms(perms, batch_size=500):
+    """ The bulk version of guardian's remove_perm.
+        `perms` is a set of (codename, group, model, object_pk).
+    """
+    for (permission, group), object_pks in _group_perms(perms).items():
+        object_pks = list(object_pks)
+        for i in range(0, len(object_pks), batch_size):
+            GroupObjectPermission.objects.filter(
+                permission=permission,
+                group=group,
+                content_type=permission.content_type,
+                object_pk__in=object_pks[i:i + batch_size],
+                ).delete()
+
+# Duplicate number highlighting. Within a project, a sign is flagged when another sign
+# shares all of the grouping values. Groups with a missing zone/type are never flagged.
+CONFLICT_GROUPINGS = (
+    ('has_conflict_type_location_number', ('sign_template_id', 'zone_id', 'number')),
+    ('has_conflict_location_number', ('zone_id', 'number')),
+    ('has_conflict_type_number', ('sign_template_id', 'number')),
+)
+
+def conflict_group(key, fields):
+    """ return the group (a tuple of values) that `key` belongs to, or None if it can't conflict """
+    group = tuple(key[f] for f in fields)
+    if None in group:
+        return None
+    return group
+
+def refresh_conflict_groups(project_id, keys):
+    """ Recount the conflict groups touched by `keys` (see Sign.conflict_key()) and flip the
+        highlight flag of the signs in those groups that are wrong. For each highlight mode that is
+        one grouped count and one update, however many groups were touched.
+        No sign is saved, so this doesn't cascade into other saves.
+
+        returns {flag: {group: number of signs in the group}}
+    """
+    group_sizes = {}
+    for flag, fields in CONFLICT_GROUPINGS:
+        groups = set(conflict_group(key, fields) for key in keys) - set([None])
+        group_sizes[flag] = dict((group, 0) for group in groups)
+        if not groups:
+            continue
+        touched = models.Q()
+        for group in groups:
+            touched |= models.Q(**dict(zip(fields, group)))
+        signs = Sign.objects.filter(touched, project_id=project_id)
+        for row in signs.order_by().values(*fields).annotate(size=models.Count('id')):
+            group_sizes[flag][tuple(row[f] for f in fields)] = row['size']
+
+        conflicting = models.Q()
+        clear = models.Q()
+        for group, size in group_sizes[flag].items():
+            if size > 1:
+                conflicting |= models.Q(**dict(zip(fields, group)))
+            else:
+                clear |= models.Q(**dict(zip(fields, group)))
+        # only the signs whose flag is wrong are written
+        wrong = models.Q()
+        if conflicting:
+            wrong |= conflicting & models.Q(**{flag: False})
+        if clear:
+            wrong |= clear & models.Q(**{flag: True})
+        if conflicting and clear:
+            value = models.Case(models.When(conflicting, then=models.Value(True)), default=models.Value(False), output_field=models.BooleanField())
+        else:
+            value = bool(conflicting)
+        signs.filter(wrong).update(**{flag: value})
+    return group_sizes
+
+def rebuild_conflicts(project, chunk_size=500):
+    """ Recompute all of the conflict flags for a project.
+        This reads the grouping values once, and only writes the signs whose flags are wrong.
+    """
+    fields = ['id', 'sign_template_id', 'zone_id', 'number'] + [flag for flag, unused in CONFLICT_GROUPINGS]
+    rows = list(Sign.objects.filter(project=project).values(*fields))
+
+    for flag, grouping in CONFLICT_GROUPINGS:
+        group_sizes = {}
+        for row in rows:
+            group = conflict_group(row, grouping)
+            if group is not None:
+                group_sizes[group] = group_sizes.get(group, 0) + 1
+
+        to_flag = []
+        to_unflag = []
+        for row in rows:
+            has_conflict = group_sizes.get(conflict_group(row, grouping), 0) > 1
+            if has_conflict and not row[flag]:
+                to_flag.append(row['id'])
+            elif row[flag] and not has_conflict:
+                to_unflag.append(row['id'])
+
+        for ids, value in ((to_flag, True), (to_unflag, False)):
+            for i in range(0, len(ids), chunk_size):
+                Sign.objects.filter(id__in=ids[i:i + chunk_size]).update(**{flag: value})
+
+def sign_templates_for(signs):
+    """ {sign template id: sign template} for the signs.
+
+        Templates already loaded on a sign are reused, the rest are fetched together without the
+        large svg_code. The signs themselves are left as they are.
+    """
+    field = Sign._meta.get_field('sign_template')
+    cache_name = field.get_cache_name()
+    sign_templates = {}
+    for sign in signs:
+        if sign.sign_template_id and hasattr(sign, cache_name):
+            sign_templates[sign.sign_template_id] = getattr(sign, cache_name)
+    missing = set(sign.sign_template_id for sign in signs if sign.sign_template_id) - set(sign_templates.keys())
+    if missing:
+        sign_templates.update((st.id, st) for st in field.related_model.objects.filter(id__in=missing).defer('svg_code'))
+    return sign_templates
+
+def attributes_for_signs(signs, sign_templates=None):
+    """ Sign.attributes() for many signs (eg. a list view, or an export).
+
+        Each sign template, zone and position layer is resolved once, however many signs share it,
+        and the local attribute instances of all the signs are fetched together.
+        sign_templates is the sign_templates_for(signs) map, if the caller already has it.
+        returns {sign id: attributes}
+    """
+    if isinstance(signs, models.QuerySet):
+        signs = signs.select_related('zone', 'position').prefetch_related('attribute_instances__attribute')
+    signs = list(signs)
+    if not signs:
+        return {}
+    ct = ContentType.objects.get_for_model(Sign)
+
+    # sign template (loaded once each)
+    if sign_templates is None:
+        sign_templates = sign_templates_for(signs)
+    template_layers = dict((template_id, st.attributes()) for template_id, st in sign_templates.items())
+
+    # zone
+    zone_layers = {}
+    for sign in signs:
+        if sign.zone_id not in zone_layers:
+            result = thread_local_cache.get("zone:%s" % sign.zone_id)
+            if result is None:
+                result = sign.zone.attributes()
+            zone_layers[sign.zone_id] = result
+
+    # position
+    position_keys = dict((u"sign.Position:{0}:attribute_instances_dict".format(sign.position_id), sign.position_id) for sign in signs)
+    position_layers = dict((position_keys[k], v) for k, v in cache.get_many(position_keys.keys()).items())
+    missing = set(position_keys.values()) - set(position_layers.keys())
+    if missing:
+        for position in Position.objects.filter(id__in=missing).prefetch_related('attribute_instances__attribute'):
+            position_layers[position.id] = position.attribute_instances_dict()
+
+    result = {}
+    for sign in signs:
+        attributes = {}
+        attributes.update(template_layers.get(sign.sign_template_id, {}))
+        attributes.update(zone_layers[sign.zone_id])
+        attributes.update(position_layers.get(sign.position_id, {}))
+        attributes.update(sign.attribute_instances_dict())
+        sign.add_synthetic_attributes(attributes, ct, sign_templates.get(sign.sign_template_id))
+        result[sign.id] = attributes
+    return result
+
+def api_json_for_signs(signs):
+    """ The message, repeating message and meta json of many signs, built together (eg. an API sync batch).
+
+        Attributes are resolved once per sign (attributes_for_signs), the sign template attribute lists once
+        per template, and the messages of all the signs are fetched together.
+        returns {sign id: (message_json, repeating_message_json, meta_json)}, each compact json or None
+    """
+    if isinstance(signs, models.QuerySet):
+        signs = signs.select_related('zone', 'position').prefetch_related(
+            'attribute_instances__attribute',
+            'sign_messages__attribute_instances__attribute',
+            )
+    signs = list(signs)
+    sign_templates = sign_templates_for(signs)
+    all_attributes = attributes_for_signs(signs, sign_templates)
+
+    template_attributes = {}
+    result = {}
+    for sign in signs:
+        message_dict = OrderedDict()
+        repeating_message_dict = OrderedDict()
+        meta_dict = OrderedDict()
+        sign_template = sign_templates.get(sign.sign_template_id)
+        if sign_template:
+            if sign.sign_template_id not in template_attributes:
+                template_attributes[sign.sign_template_id] = (
+                    list(sign_template.message_attributes()),
+                    list(sign_template.repeating_attributes()),
+                    list(sign_template.meta_attributes()),
+                    sign_template.number_of_repeating(),
+                )
+            attributes_message, attributes_repeating, attributes_meta, number_of_repeating = template_attributes[sign.sign_template_id]
+
+            # message
+            attributes = all_attributes[sign.id]
+            for a in attributes_message:
+                value, source = attributes.get(a.slug, ('',None))
+                if value != '-unknown-':
+                    message_dict[unicode(a)] = {'type': a.field_type, 'value': escape(value)}
+
+            # repeating
+            for a in attributes_repeating:
+                repeating_message_dict[unicode(a)] = {'type': a.field_type, 'values': []}
+            if attributes_repeating:
+                message_list = list(sign.sign_messages.all())
+                # we take the min because there may be message objects created and # of messages reduced
+                number_of_real_messages = min(len(message_list), number_of_repeating)
+                for message in message_list[:number_of_real_messages]:
+                    aid = message.attribute_instances_dict()
+                    for a in attributes_repeating:
+                        repeating_message_dict[unicode(a)]['values'].append(aid.get(a.slug, ("", None))[0])
+                # the missing messages have always only been padded on the last attribute, the api clients expect that
+                for k in range(number_of_real_messages, number_of_repeating):
+                    repeating_message_dict[unicode(attributes_repeating[-1])]['values'].append("")
+
+            # meta, local values only
+            aid = sign.attribute_instances_dict()
+            for a in attributes_meta:
+                value, source = aid.get(a.slug, ('',None))
+                if value != '-unknown-':
+                    meta_dict[unicode(a)] = {'type': a.field_type, 'value': escape(value)}
+
+        result[sign.id] = tuple(
+            json.dumps(d, separators=(',', ':')) if d else None
+            for d in (message_dict, repeating_message_dict, meta_dict)
+        )
+    return result
+
+def snapshot_repeating_attributes(sign_template_id):
+    """ the repeating attributes included in Sign.snapshot() """
+    return list(Attribute.objects.filter(
+                    is_inheritable=False,
+                    group="message",
+                    sign_template_attributes__is_repeating=True,
+                    sign_template_attributes__sign_template_id=sign_template_id
+                    ).order_by('sign_template_attributes'))
+
+SNAPSHOT_ORDER = ('zone_sort', 'number_sort', 'id')
+
+def keyset_chunks(qs, order=SNAPSHOT_ORDER, chunk_size=500):
+    """ Iterate over a queryset in chunks, each one fetched after the last row of the previous one
+        (rather than with an offset, which gets slower as it goes). `order` has to end with a unique field.
+        yields lists of objects
+    """
+    last = None
+    while True:
+        chunk_qs = qs.order_by(*order)
+        if last is not None:
+            # (a, b, id) > (last_a, last_b, last_id)
+            after = models.Q(pk__in=[])
+            for i, field in enumerate(order):
+                q = models.Q(**{field + "__gt": last[i]})
+                for previous_field, previous_value in zip(order[:i], last[:i]):
+                    q &= models.Q(**{previous_field: previous_value})
+                after |= q
+            chunk_qs = chunk_qs.filter(after)
+        chunk = list(chunk_qs[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = [getattr(chunk[-1], field) for field in order]
+
+def iter_snapshots(signs, chunk_size=500):
+    """ Sign.snapshot() for every sign in a queryset (eg. a project export), with constant memory.
+        Signs are read in keyset ordered chunks (zone, then number) and each chunk's tags, messages and
+        attribute instances are prefetched in a fixed number of queries.
+        yields (sign, snapshot)
+    """
+    signs = signs.select_related('sign_template', 'state').prefetch_related(
+        'tags',
+        'attribute_instances__attribute',
+        'sign_messages__attribute_instances__attribute',
+        )
+    repeating = {}
+    for chunk in keyset_chunks(signs, chunk_size=chunk_size):
+        for sign in chunk:
+            if sign.sign_template_id not in repeating:
+                repeating[sign.sign_template_id] = snapshot_repeating_attributes(sign.sign_template_id)
+            yield sign, sign.snapshot(attributes_repeating=repeating[sign.sign_template_id])
+
+def snapshot_columns(signs):
+    """ the csv columns of a snapshot export of a queryset, worked out with aggregate queries rather than
+        by snapshotting every sign first
+    """
+    columns = ['number', 'sign_template', 'state', 'facing_direction', 'quantity', 'tags', 'custom_artwork']
+
+    # regular attributes
+    ct = ContentType.objects.get_for_model(Sign)
+    columns.extend(sorted(set(related_model('AttributeInstance').objects.filter(
+                    content_type=ct,
+                    object_id__in=signs.values('id'),
+                    ).values_list('attribute__slug', flat=True).distinct())))
+
+    # repeating, as many messages as the sign with the most messages (for each sign template)
+    max_messages = {}
+    message_counts = related_model('SignMessage').objects.filter(sign__in=signs).values('sign_id', 'sign__sign_template_id').annotate(num_messages=models.Count('id')).order_by()
+    for row in message_counts.iterator():
+        sign_template_id = row['sign__sign_template_id']
+        max_messages[sign_template_id] = max(max_messages.get(sign_template_id, 0), row['num_messages'])
+    repeating_columns = OrderedDict()
+    for sign_template_id, num_messages in sorted(max_messages.items()):
+        attributes_repeating = snapshot_repeating_attributes(sign_template_id)
+        for i in range(num_messages):
+            for a in attributes_repeating:
+                repeating_columns['message_{0}.{1}'.format(i + 1, a.slug)] = True
+    columns.extend(sorted(repeating_columns.keys(), key=lambda c: (int(c.split(".", 1)[0][8:]), c)))
+    return columns
+
+class _Echo(object):
+    """ a file-like object that hands back what is written to it (for streaming csv) """
+    def write(self, value):
+        return value
+
+def export_snapshots(signs, format="csv", chunk_size=500):
+    """ A project export, as an iterator of utf-8 lines (give it to a StreamingHttpResponse, or write it to a file)
+        `format` is "csv" or "ndjson" (one json snapshot per line)
+    """
+    if format == "ndjson":
+        for sign, data in iter_snapshots(signs, chunk_size=chunk_size):
+            yield json.dumps(data, sort_keys=True) + "\n"
+        return
+
+    columns = snapshot_columns(signs)
+    writer = csv.writer(_Echo())
+    yield writer.writerow([c.encode('utf-8') for c in columns])
+    for sign, data in iter_snapshots(signs, chunk_size=chunk_size):
+        yield writer.writerow([unicode(data.get(c, "")).encode('utf-8') for c in columns])
+
+def export_snapshots_response(signs, format="csv", filename="signs"):
+    """ A streaming download of export_snapshots """
+    content_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(export_snapshots(signs, format=format), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(filename, format)
+    return response
+
+def color_css(colors):
+    """ one <style> block with the `.color_xxx` rules for a list of (hex) colors """
+    if not colors:
+        return ""
+    rules = []
+    for color in OrderedDict.fromkeys(colors):
+        rules.append(""".color_{0}{{
+                                        background-color: #{0} !important;
+                                        color: #{1} !important;
+                                        padding: 3px !important;
+                                        }}""".format(color, font_color(color)))
+    return """<style>
+                                    @media all{
+                                    """ + "\n".join(rules) + """
+                                    }
+                                </style>"""
+
+class SignSummaryRenderer(object):
+    """ Renders the message_html and meta_html summaries.
+
+        Instead of a <style> block for every colored value, the colors used are collected in
+        `self.colors` (see color_css). Colors, and the attribute lists of each sign template, are
+        looked up once per renderer.
+    """
+    def __init__(self, colors_by_id=None, sign_templates=None):
+        self.colors_by_id = colors_by_id if colors_by_id is not None else {}
+        self.sign_templates = sign_templates if sign_templates is not None else {}
+        self.colors = []
+        self._sign_templates = {}
+
+    def sign_template(self, sign):
+        if not sign.sign_template_id:
+            return None
+        if sign.sign_template_id not in self.sign_templates:
+            self.sign_templates[sign.sign_template_id] = sign.sign_template
+        return self.sign_templates[sign.sign_template_id]
+
+    def color(self, color_id):
+        color_id = int(color_id)
+        if color_id not in self.colors_by_id:
+            self.colors_by_id[color_id] = Color.objects.get(id=color_id)
+        return self.colors_by_id[color_id]
+
+    def use_color(self, color):
+        if color not in self.colors:
+            self.colors.append(color)
+
+    def sign_template_info(self, sign_template):
+        if sign_template.id not in self._sign_templates:
+            info = {
+                'message_attributes': sign_template.message_attributes(),
+                'meta_attributes': sign_template.meta_attributes(),
+                'repeating_attributes': sign_template.repeating_attributes(),
+                'number_of_repeating': sign_template.number_of_repeating(),
+            }
+            if info['repeating_attributes']:
+                info['side_dict'] = sign_template.side_dict()
+                info['column_dict'] = sign_template.column_dict()
+            self._sign_templates[sign_template.id] = info
+        return self._sign_templates[sign_template.id]
+
+    def attribute_html(self, a, value, text_dict):
+        """ a message or meta attribute, as a label and paragraph """
+        html = ["<b>", unicode(a), "</b>"]
+        if a.field_type == "color":
+            self.use_color(value)
+            html.append("<p class='color_"+value+"'>"+value+"</p>")
+        elif a.field_type in ["color_x",'color_t']:
+            color = self.color(value)
+            self.use_color(color.color)
+            html.append("<p class='color_"+color.color+"'>"+color.name+"</p>")
+        elif a.field_type in ["icon",'icon_t']:
+            unused_value, source, text_value = text_dict.get(a.slug, ('',None,''))
+            html.append("<p><img height='15px' src='/sign_message/icon/"+value+"/thumbnail_url/40/' alt='"+text_value+"'></p>")
+        else:
+            html.append("<p>"+linebreaksbr(value)+"</p>")
+        return "".join(html)
+
+    def message_html(self, sign, sign_attribute_data):
+        html = []
+        sign_template = self.sign_template(sign)
+        if sign_template:
+            info = self.sign_template_info(sign_template)
+            attribute_instances_text_dict = sign.attribute_instances_text_dict()
+            for a in info['message_attributes']:
+                value, source = sign_attribute_data.get(a.slug, ('',None))
+                if value and value != '-unknown-':
+                    html.append(self.attribute_html(a, escape(value), attribute_instances_text_dict))
+
+            attributes_repeating = info['repeating_attributes']
+
+            message_list = list(sign.sign_messages.all())
+            number_of_real_messages = min(len(message_list), info['number_of_repeating'])
+            # we take the min because there may be message objects created and # of messages reduced
+            # Find the first non empty value and set the counter to remove empty values
+            if attributes_repeating:
+                attributes_repeating_count = len(attributes_repeating)
+                for k in range(number_of_real_messages-1,-1,-1):
+                    #check the last element to see if its empty
+                    message = message_list[k]
+                    message_data = message.attribute_instances_dict()
+                    for a in attributes_repeating:
+                        value, source = message_data.get(a.slug, (None, None))
+                        if value:
+                            break
+                    if value:
+                        break
+                    else:
+                        number_of_real_messages -= 1
+
+                if number_of_real_messages != 0:
+                    html.append("<table class='attributes_repeating_table'><thead><tr>")
+                    for a in attributes_repeating:
+                        html.append("<th>"+unicode(a)+"</th>")
+                    html.append("</tr></thead><tbody>")
+
+                    side_dict = info['side_dict']
+                    column_dict = info['column_dict']
+                    for k in range(number_of_real_messages):
+                        side_num = side_dict.get(k, None)
+                        column_num = column_dict.get(k, None)
+                        if side_num:
+                            html.append('<tr class="tr_side_number_expanded_list">')
+                            html.append('<td colspan="{0}"><b>Side {1}</b></td>'.format(attributes_repeating_count, side_num))
+                            html.append('</tr>')
+                        if column_num:
+                            html.append('<tr class="tr_column_number_expanded_list">')
+                            html.append('<td colspan="{0}">Column {1}</td>'.format(attributes_repeating_count, column_num))
+                            html.append('</tr>')
+
+                        html.append("<tr>")
+                        message = message_list[k]
+                        message_dict = {}
+                        message_data = message.attribute_instances_dict()
+                        attribute_instances_text_dict = message.attribute_instances_text_dict()
+                        # colors and icons are looked up by their stored id (see colors_by_id), not per cell
+                        for ai in message.attribute_instances.all():
+                            if ai.attribute.field_type not in ["color_x",'color_t',"icon",'icon_t']:
+                                message_dict[ai.attribute_id] = ai.value()
+
+                        for a in attributes_repeating:
+                            value = message_dict.get(a.id)
+                            if not value:
+                                value = ""
+                            if a.field_type == "color":
+                                value = escape(value)
+                                self.use_color(value)
+                                html.append("<td class='color_"+value+"'>"+value+"</td>")
+                            elif a.field_type in ["color_x",'color_t']:
+                                color_id = message_data.get(a.slug, ('',None))[0]
+                                if color_id and color_id != '-unknown-':
+                                    color = self.color(color_id)
+                                    self.use_color(color.color)
+                                    html.append("<td class='color_"+color.color+"'>"+color.name+"</td>")
+                                else:
+                                    html.append("<td></td>")
+                            elif a.field_type in ["icon",'icon_t']:
+                                icon_id = message_data.get(a.slug, ('',None))[0]
+                                if icon_id and icon_id != '-unknown-':
+                                    unused_value, source, text_value = attribute_instances_text_dict.get(a.slug, ('',None, ''))
+                                    html.append("<td style='text-align:center'><img height='15px' src='/sign_message/icon/"+escape(icon_id)+"/thumbnail_url/40/' alt='"+text_value+"'></td>")
+                                else:
+                                    html.append("<td></td>")
+                            else:
+                                if not value:
+                                    value = "\n"
+                                html.append("<td>"+linebreaksbr(escape(value))+"</td>")
+                        html.append("</tr>")
+                    html.append("</tbody></table>")
+        return "".join(html)
+
+    def meta_html(self, sign):
+        html = []
+        sign_template = self.sign_template(sign)
+        if sign_template:
+            info = self.sign_template_info(sign_template)
+            aid = sign.attribute_instances_dict()
+            aid_text = sign.attribute_instances_text_dict()
+            for a in info['meta_attributes']:
+                value = aid.get(a.slug, ('',None))[0]
+                if value and value != '-unknown-':
+                    html.append(self.attribute_html(a, escape(value), aid_text))
+        return "".join(html)
+
+def render_sign_summaries(signs):
+    """ message_html and meta_html for a page of signs (eg. the expanded list view).
+
+        Cached summaries are fetched together. For the rest, the attributes, messages and their
+        attribute instances, and colors are fetched in a fixed number of queries.
+        returns ({sign id: (message_html, meta_html)}, css) where css is a single <style> block with
+        the color rules for the whole page.
+    """
+    signs = list(signs)
+    cached, signatures = derived_get_many(["sign_message_summary", "sign_meta_summary"], signs)
+    messages = cached["sign_message_summary"]
+    metas = cached["sign_meta_summary"]
+
+    to_render = [sign for sign in signs if sign.id not in messages or sign.id not in metas]
+    if to_render:
+        models.prefetch_related_objects(to_render, 'attribute_instances__attribute', 'sign_messages__attribute_instances__attribute')
+        sign_templates = sign_templates_for(to_render)
+        sign_attribute_data = attributes_for_signs(to_render, sign_templates)
+
+        # colors for the message, repeating message and meta attributes
+        renderer = SignSummaryRenderer(sign_templates=sign_templates)
+        color_ids = set()
+        for sign in to_render:
+            sign_template = renderer.sign_template(sign)
+            if not sign_template:
+                continue
+            info = renderer.sign_template_info(sign_template)
+            aid = sign.attribute_instances_dict()
+            for a in info['message_attributes']:
+                if a.field_type in ["color_x",'color_t']:
+                    color_ids.add(sign_attribute_data[sign.id].get(a.slug, ('',None))[0])
+            for a in info['meta_attributes']:
+                if a.field_type in ["color_x",'color_t']:
+                    color_ids.add(aid.get(a.slug, ('',None))[0])
+            repeating_colors = [a for a in info['repeating_attributes'] if a.field_type in ["color_x",'color_t']]
+            if repeating_colors:
+                for message in sign.sign_messages.all():
+                    message_data = message.attribute_instances_dict()
+                    for a in repeating_colors:
+                        color_ids.add(message_data.get(a.slug, ('',None))[0])
+        color_ids = [int(color_id) for color_id in color_ids if color_id and color_id != '-unknown-']
+        renderer.colors_by_id.update((color.id, color) for color in Color.objects.filter(id__in=color_ids))
+
+        new_messages = {}
+        new_metas = {}
+        for sign in to_render:
+            if sign.id not in messages:
+                renderer.colors = []
+                messages[sign.id] = new_messages[sign.id] = (renderer.message_html(sign, sign_attribute_data[sign.id]), renderer.colors)
+            if sign.id not in metas:
+                renderer.colors = []
+                metas[sign.id] = new_metas[sign.id] = (renderer.meta_html(sign), renderer.colors)
+        derived_set_many("sign_message_summary", signatures, new_messages)
+        derived_set_many("sign_meta_summary", signatures, new_metas)
+
+    colors = []
+    result = {}
+    for sign in signs:
+        message_html, message_colors = messages[sign.id]
+        meta_html, meta_colors = metas[sign.id]
+        colors.extend(message_colors)
+        colors.extend(meta_colors)
+        result[sign.id] = (message_html, meta_html)
+    return result, color_css(colors)
+
+# how much a match counts for, by where the term was found
+SEARCH_WEIGHTS = {
+    'number': 8,
+    'label': 6,
+    'tag': 4,
+    'attribute': 2,
+}
+SEARCH_TERM_RE = re.compile(r"\w+", re.UNICODE)
+SEARCH_TERM_MAX_LENGTH = 64
+SEARCH_MIN_SUFFIX_LENGTH = 2
+
+def search_tokens(text):
+    """ split text into lower case search terms """
+    if text is None:
+        return []
+    return [t[:SEARCH_TERM_MAX_LENGTH] for t in SEARCH_TERM_RE.findall(unicode(text).lower())]
+
+def _add_search_terms(terms, text, weight):
+    """ add the terms (and their suffixes) of `text` to a {(term, offset): weight} dict """
+    for token in search_tokens(text):
+        for offset in range(max(1, len(token) - SEARCH_MIN_SUFFIX_LENGTH + 1)):
+            key = (token[offset:], offset)
+            terms[key] = max(terms.get(key, 0), weight)
+
+def reindex_signs(sign_ids, chunk_size=200):
+    """ Rebuild the search index (and combined_search_text) for some signs """
+    sign_ids = list(OrderedDict.fromkeys(sign_ids))
+    SignTemplate = related_model('SignTemplate')
+    sign_templates = {}
+    search_attributes = {}
+    for i in range(0, len(sign_ids), chunk_size):
+        chunk = sign_ids[i:i + chunk_size]
+        signs = list(Sign.objects.filter(id__in=chunk).select_related('zone', 'project').prefetch_related(
+                        'tags',
+                        'attribute_instances__attribute',
+                        'sign_messages__attribute_instances__attribute',
+                        ))
+        missing = set(s.sign_template_id for s in signs if s.sign_template_id) - set(sign_templates.keys())
+        sign_templates.update((st.id, st) for st in SignTemplate.objects.filter(id__in=missing).defer('svg_code'))
+
+        rows = []
+        with transaction.atomic():
+            SignSearchTerm.objects.filter(sign_id__in=chunk).delete()
+            for sign in signs:
+                if sign.sign_template_id:
+                    sign.sign_template = sign_templates[sign.sign_template_id]
+                if sign.sign_template_id not in search_attributes:
+                    search_attributes[sign.sign_template_id] = sign.search_attributes()
+                values = sign.search_attribute_values(search_attributes[sign.sign_template_id])
+
+                terms = {}
+                _add_search_terms(terms, sign.number, SEARCH_WEIGHTS['number'])
+                _add_search_terms(terms, unicode(sign), SEARCH_WEIGHTS['label'])
+                for tag in sign.tags.all():
+                    _add_search_terms(terms, tag.tag, SEARCH_WEIGHTS['tag'])
+                for value in values:
+                    _add_search_terms(terms, value, SEARCH_WEIGHTS['attribute'])
+                for (term, offset), weight in terms.items():
+                    rows.append(SignSearchTerm(sign_id=sign.id, project_id=sign.project_id, term=term, offset=offset, weight=weight))
+
+                combined_search_text = u"".join(u" " + value for value in values)
+                if combined_search_text != sign.combined_search_text:
+                    Sign.objects.filter(id=sign.id).update(combined_search_text=combined_search_text)
+            SignSearchTerm.objects.bulk_create(rows, batch_size=1000)
+
+def rebuild_search_index(project, chunk_size=200):
+    """ Rebuild the search index for a whole project """
+    reindex_signs(list(Sign.objects.filter(project=project).order_by('id').values_list('id', flat=True)), chunk_size=chunk_size)
+
+def request_reindex(sign_ids):
+    """ Reindex some signs once the current transaction commits. Small batches are reindexed
+        straight away, larger ones are handed to the sign:reindex_search job.
+
+        Outside of a transaction (eg. each attribute instance of a form saved in autocommit) the signs go
+        to a sign:reindex_search job a few seconds later (SIGN_SEARCH_REINDEX_DELAY), and a sign that is
+        already waiting on that job isn't sent again.
+    """
+    sign_ids = [sign_id for sign_id in sign_ids if sign_id]
+    if not sign_ids:
+        return
+    if connection.in_atomic_block:
+        on_commit_batch("sign:reindex_search", sign_ids, _flush_reindex)
+    else:
+        _send_reindex_job(sign_ids)
+
+def _reindex_pending_key(sign_id):
+    return "sign_reindex_pending:%s" % sign_id
+
+def _send_reindex_job(sign_ids):
+    delay_seconds = getattr(settings, 'SIGN_SEARCH_REINDEX_DELAY', 5)
+    # pending until the job starts. the timeout is a safety net for jobs that never run
+    new_ids = [sign_id for sign_id in OrderedDict.fromkeys(sign_ids) if cache.add(_reindex_pending_key(sign_id), 1, delay_seconds + 300)]
+    if new_ids:
+        jobber.send(name='sign:reindex_search', sign_ids=new_ids, delay_seconds=delay_seconds)
+
+def _flush_reindex(sign_ids):
+    sign_ids = list(OrderedDict.fromkeys(sign_ids))
+    if len(sign_ids) <= getattr(settings, 'SIGN_SEARCH_REINDEX_INLINE', 50):
+        reindex_signs(sign_ids)
+    else:
+        for i in range(0, len(sign_ids), 500):
+            jobber.send(name='sign:reindex_search', sign_ids=sign_ids[i:i + 500])
+
+def reindex_search(**kwargs):
+    """ `job = jobber.send(name='sign:reindex_search', sign_ids=[self.id,])` """
+    sign_ids = kwargs.pop('sign_ids')
+    # changes from here on need a new job
+    cache.delete_many([_reindex_pending_key(sign_id) for sign_id in sign_ids])
+    reindex_signs(sign_ids)
+jobber.connect(reindex_search, name='sign:reindex_search', dispatch_uid='sign:reindex_search')
+
+def node_renderer_version(fetch=True):
+    """ The renderer version reported by node (GET /version/). It is part of every render cache key,
+        so upgrading node invalidates the render cache without having to flush it.
+        returns None when node can't tell us, in which case nothing should be cached. A failed or empty
+        answer is remembered (as "") for a few seconds, so we don't ask again on every call.
+        With fetch=False node isn't asked at all (eg. while building a page), only a version we already have is returned.
+    """
+    version = cache.get("node_renderer_version")
+    if version is None and fetch:
+        try:
+            version = node_render("version", method="get", retries=0).text.strip()
+        except RenderError:
+            version = ""
+        cache.set("node_renderer_version", version, 60 if version else 10)
+    return version or None
+
+def render_content_name(kind, content):
+    """ content-addressed ArtworkStore name for a node render (`kind` is "expand" or "png") """
+    version = node_renderer_version()
+    if version is None:
+        return None
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    digest = hashlib.sha1(content).hexdigest()
+    return "{0}/{1}/{2}/{3}".format(kind, _renderer_version_segment(version), digest[:2], digest)
+
+def _renderer_version_segment(version):
+    return hashlib.sha1(version.encode('utf-8')).hexdigest()[:12]
+
+def render_name_is_current(name):
+    """ Whether an ArtworkStore name was rendered by the node we have now, ie. it is a render_content_name
+        for node's current renderer version. (the per-sign "png/sign/..." names made while node couldn't
+        tell us its version never are.) While node can't tell us, whatever we have is kept.
+    """
+    version = node_renderer_version()
+    if version is None:
+        return True
+    return name.split("/")[1:2] == [_renderer_version_segment(version)]
+
+class ArtworkStore(object):
+    """ Rendered artwork (expanded svgs and pngs), by content-addressed name (see render_content_name).
+
+        Two tiers: a bounded per-process LRU in memory, over a Storage (by default the filesystem,
+        under MEDIA_ROOT/sign_artwork). Keeping the blobs out of the shared cache leaves it to the small
+        hot keys, and the files survive a cache restart. Local files can be served with sendfile (see path).
+
+        settings:
+            SIGN_ARTWORK_STORAGE            dotted path of a Storage class (default FileSystemStorage)
+            SIGN_ARTWORK_MEMORY_BYTES       memory tier budget, per process (default 32MB)
+            SIGN_ARTWORK_STORAGE_BYTES      storage tier budget, enforced by trim() (default None, unbounded)
+            SIGN_ARTWORK_TRIM_INTERVAL      at most one trim job per this many seconds (default 3600)
+            SIGN_ARTWORK_COMPRESS           the kinds that are zlib compressed in storage (default ("expand",))
+    """
+    def __init__(self, storage=None, memory_bytes=None, storage_bytes=None, compress=None):
+        if storage is None:
+            storage_class = getattr(settings, 'SIGN_ARTWORK_STORAGE', None)
+            if storage_class:
+                storage = get_storage_class(storage_class)()
+            else:
+                storage = FileSystemStorage(location=os.path.join(settings.MEDIA_ROOT, "sign_artwork"))
+        self.storage = storage
+        self.memory_bytes = memory_bytes if memory_bytes is not None else getattr(settings, 'SIGN_ARTWORK_MEMORY_BYTES', 32 * 1024 * 1024)
+        self.storage_bytes = storage_bytes if storage_bytes is not None else getattr(settings, 'SIGN_ARTWORK_STORAGE_BYTES', None)
+        self.compress = set(compress if compress is not None else getattr(settings, 'SIGN_ARTWORK_COMPRESS', ("expand",)))
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+
+    def _file_name(self, name):
+        if name.split("/", 1)[0] in self.compress:
+            return name + ".z"
+        return name
+
+    def get(self, name):
+        """ the content stored under `name`, or None """
+        with self._lock:
+            content = self._memory.pop(name, None)
+            if content is not None:
+                self._memory[name] = content
+        if content is not None:
+            incr_stat("artwork_store:memory_hit")
+            return content
+
+        file_name = self._file_name(name)
+        try:
+            with self.storage.open(file_name, "rb") as f:
+                content = f.read()
+        except (IOError, OSError):
+            incr_stat("artwork_store:miss")
+            return None
+        if file_name != name:
+            try:
+                content = zlib.decompress(content)
+            except zlib.error:
+                incr_stat("artwork_store:miss")
+                return None
+        incr_stat("artwork_store:storage_hit")
+        self._remember(name, content)
+        return content
+
+    def put(self, name, content):
+        """ store `content` (bytes) under `name`. Content-addressed, so an existing file is left alone """
+        file_name = self._file_name(name)
+        if not self.storage.exists(file_name):
+            data = zlib.compress(content) if file_name != name else content
+            if not self._put_local(file_name, data):
+                # other storages (object storage) replace an object in one go
+                saved_name = self.storage.save(file_name, ContentFile(data))
+                if saved_name != file_name:
+                    # someone else wrote it at the same time
+                    self.storage.delete(saved_name)
+            incr_stat("artwork_store:write")
+            # the size of the storage tier is tracked as it's written, see maybe_trim
+            incr_stat("artwork_store:bytes", len(data))
+        self._remember(name, content)
+
+    def _put_local(self, file_name, data):
+        """ write a local file under a temporary name and rename it into place, so that nobody
+            reads it half written. returns False if the storage isn't on the local filesystem
+        """
+        try:
+            path = self.storage.path(file_name)
+        except NotImplementedError:
+            return False
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # made by someone else in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        tmp = tempfile.NamedTemporaryFile(dir=directory, prefix=".tmp-", delete=False)
+        try:
+            tmp.write(data)
+            tmp.close()
+            os.chmod(tmp.name, getattr(self.storage, 'file_permissions_mode', None) or 0o644)
+            os.rename(tmp.name, path)
+        except:
+            if os.path.exists(tmp.name):
+                os.remove(tmp.name)
+            raise
+        return True
+
+    def path(self, name):
+        """ the local file path of `name` (for sendfile), or None when it isn't stored, is compressed,
+            or the storage isn't on the local filesystem
+        """
+        file_name = self._file_name(name)
+        if file_name != name:
+            return None
+        try:
+            path = self.storage.path(file_name)
+        except NotImplementedError:
+            return None
+        if not os.path.exists(path):
+            return None
+        return path
+
+    def _remember(self, name, content):
+        """ add to the memory tier, evicting the least recently used """
+        size = len(content)
+        if size > self.memory_bytes // 8:
+            # one large blob shouldn't flush the whole tier
+            return
+        evicted = 0
+        with self._lock:
+            old = self._memory.pop(name, None)
+            if old is not None:
+                self._memory_size -= len(old)
+            self._memory[name] = content
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                old_name, old = self._memory.popitem(last=False)
+                self._memory_size -= len(old)
+                evicted += 1
+        incr_stat("artwork_store:memory_eviction", evicted)
+
+    def _walk(self, path=""):
+        dirs, files = self.storage.listdir(path)
+        for file_name in files:
+            yield "{0}/{1}".format(path, file_name) if path else file_name
+        for dir_name in dirs:
+            for file_name in self._walk("{0}/{1}".format(path, dir_name) if path else dir_name):
+                yield file_name
+
+    def trim(self):
+        """ delete the least recently modified files until the storage tier is within SIGN_ARTWORK_STORAGE_BYTES
+            returns the number of files deleted
+        """
+        if not self.storage_bytes:
+            return 0
+        files = []
+        total = 0
+        for file_name in self._walk():
+            size = self.storage.size(file_name)
+            files.append((self.storage.get_modified_time(file_name), size, file_name))
+            total += size
+        files.sort()
+        deleted = 0
+        for modified, size, file_name in files:
+            if total <= self.storage_bytes:
+                break
+            self.storage.delete(file_name)
+            total -= size
+            deleted += 1
+        incr_stat("artwork_store:storage_eviction", deleted)
+        # correct the tracked size
+        cache.set("sign_stats:artwork_store:bytes", total, None)
+        return deleted
+
+    def maybe_trim(self):
+        """ queue a trim (which lists every file) only when the tracked size is over budget, and at most
+            once per SIGN_ARTWORK_TRIM_INTERVAL
+        """
+        if not self.storage_bytes:
+            return
+        if get_stats(["artwork_store:bytes"])["artwork_store:bytes"] <= self.storage_bytes:
+            return
+        if cache.add("artwork_store:trim_queued", 1, getattr(settings, 'SIGN_ARTWORK_TRIM_INTERVAL', 3600)):
+            jobber.send(name='sign:trim_artwork_store')
+
+    def stats(self):
+        """ the shared counters, and this process' memory tier """
+        result = get_stats(["artwork_store:memory_hit", "artwork_store:storage_hit", "artwork_store:miss",
+                            "artwork_store:write", "artwork_store:memory_eviction", "artwork_store:storage_eviction"])
+        result['memory_entries'] = len(self._memory)
+        result['memory_bytes'] = self._memory_size
+        return result
+
+def prefetch_svg_fingerprints(signs):
+    """ work out Sign.svg_fingerprint for a page of signs, with one cache round trip.
+        Node isn't asked for its version here. When we don't have it, the fingerprints are None and the urls
+        aren't versioned (they are revalidated, rather than cached for a year with a png that may be stale)
+    """
+    signs = [sign for sign in signs if sign.id]
+    version = node_renderer_version(fetch=False)
+    if version is None:
+        for sign in signs:
+            sign._svg_fingerprint = None
+        return
+    pairs = OrderedDict.fromkeys(pair for sign in signs for pair in derived_dependencies(sign))
+    current = generations(pairs.keys())
+    for sign in signs:
+        signature = u",".join(unicode(current[pair]) for pair in derived_dependencies(sign))
+        sign._svg_fingerprint = hashlib.sha1(u"{0}:{1}".format(version, signature).encode('utf-8')).hexdigest()[:16]
+
+def artwork_response(request, etag_func, content_func, content_type="image/png"):
+    """ Serve artwork with HTTP caching. `etag_func()` returns the strong ETag of the artwork (or None while
+        it's being generated) and `content_func()` returns its content.
+
+        - An If-None-Match that matches the ETag gets a 304, without loading the content.
+        - Versioned urls (`?v=`, see Sign.get_svg_url) are cacheable for a year, they change when the artwork does.
+        - Unversioned urls have to be revalidated, and placeholders (no ETag) aren't cached at all.
+    """
+    etag = etag_func()
+    if etag:
+        quoted = '"{0}"'.format(etag)
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', "")
+        if quoted in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            response = HttpResponseNotModified()
+            response['ETag'] = quoted
+            return response
+
+    content = content_func()
+    if etag is None:
+        # generating the content may have stored it
+        etag = etag_func()
+    response = HttpResponse(content, content_type=content_type)
+    if etag:
+        response['ETag'] = '"{0}"'.format(etag)
+        if request.GET.get('v'):
+            response['Cache-Control'] = "public, max-age=31536000, immutable"
+        else:
+            response['Cache-Control'] = "no-cache"
+    else:
+        response['Cache-Control'] = "no-store"
+    return response
+
+def _render_lock_key(name):
+    return "sign_render_lock:%s" % name
+
+def acquire_render_lock(name):
+    """ Single flight lock for a render (`name` is like "sign:<id>" or "png:<content hash>").
+        returns a token for release_render_lock, or None when someone else is rendering it.
+        The lock expires after SIGN_RENDER_LOCK_TTL seconds (by default, the longest a render can take),
+        in case its worker dies mid-render.
+    """
+    token = uuid.uuid4().hex
+    if cache.add(_render_lock_key(name), token, getattr(settings, 'SIGN_RENDER_LOCK_TTL', None) or max_render_seconds()):
+        incr_stat("render_lock:acquired")
+        return token
+    incr_stat("render_lock:contended")
+    return None
+
+def release_render_lock(name, token):
+    key = _render_lock_key(name)
+    # don't release a lock that expired and was taken by someone else
+    if cache.get(key) == token:
+        cache.delete(key)
+
+def render_lock_held(name):
+    return cache.get(_render_lock_key(name)) is not None
+
+def wait_for_render_lock(name):
+    """ wait (up to SIGN_RENDER_LOCK_WAIT seconds) for someone else's render to finish.
+        returns True if it finished, False if we gave up
+    """
+    key = _render_lock_key(name)
+    deadline = time.time() + getattr(settings, 'SIGN_RENDER_LOCK_WAIT', 5)
+    while cache.get(key) is not None:
+        if time.time() >= deadline:
+            incr_stat("render_lock:gave_up")
+            return False
+        time.sleep(0.25)
+    incr_stat("render_lock:waited")
+    return True
+
+_artwork_store = []
+def artwork_store():
+    """ the process wide ArtworkStore """
+    if not _artwork_store:
+        _artwork_store.append(ArtworkStore())
+    return _artwork_store[0]
+
+def trim_artwork_store(**kwargs):
+    """ `job = jobber.send(name='sign:trim_artwork_store')`, queued by ArtworkStore.maybe_trim (or on a schedule) """
+    print "Trimming the artwork store..."
+    deleted = artwork_store().trim()
+    print "Trimming the artwork store. Done, {0} files deleted.".format(deleted)
+jobber.connect(trim_artwork_store, name='sign:trim_artwork_store', dispatch_uid='sign:trim_artwork_store')
 
 models.signals.post_save.connect(update_api_sync_info, sender=Sign)
 models.signals.pre_delete.connect(update_api_sync_info, sender=Sign)
 
+def tags_sort_values(sign_ids):
+    """ {sign id: tags_sort} worked out from the tags in the database, in the same order as sign.tags.all() """
+    Tag = Sign._meta.get_field('tags').related_model
+    ordering = []
+    for field in Tag._meta.ordering:
+        if field.startswith("-"):
+            ordering.append("-tag__" + field[1:])
+        else:
+            ordering.append("tag__" + field)
+    ordering.append("id")
+
+    tag_lists = dict((sign_id, []) for sign_id in sign_ids)
+    for sign_id, tag in Sign.tags.through.objects.filter(sign_id__in=sign_ids).order_by(*ordering).values_list('sign_id', 'tag__tag'):
+        tag_lists[sign_id].append(tag)
+    return dict((sign_id, ", ".join(tags)[:255]) for sign_id, tags in tag_lists.items())
+
+def _write_tags_sort(values):
+    """ write {sign id: tags_sort} with one aggregated update """
+    if values:
+        Sign.objects.filter(id__in=values.keys()).update(tags_sort=models.Case(
+            *[models.When(id=sign_id, then=models.Value(tags_sort)) for sign_id, tags_sort in values.items()],
+            default=models.F('tags_sort'),
+            output_field=models.CharField()
+            ))
+
+def refresh_tags_sort(sign_ids, chunk_size=500):
+    """ Recompute tags_sort for some signs, with one aggregated update per chunk (the signs aren't saved)
+        returns {sign id: tags_sort} for the signs that changed
+    """
+    sign_ids = list(set(sign_ids))
+    changed = {}
+    for i in range(0, len(sign_ids), chunk_size):
+        chunk = sign_ids[i:i + chunk_size]
+        values = tags_sort_values(chunk)
+        chunk_changed = {}
+        for sign_id, tags_sort in Sign.objects.filter(id__in=chunk).values_list('id', 'tags_sort'):
+            if values[sign_id] != tags_sort:
+                chunk_changed[sign_id] = values[sign_id]
+        _write_tags_sort(chunk_changed)
+        changed.update(chunk_changed)
+
+        # update() skips the post_save signal (reversion, api sync info). the signs are loaded a chunk at a time
+        for sign in Sign.objects.filter(id__in=chunk_changed.keys()):
+            models.signals.post_save.send(sender=Sign, instance=sign, created=False, update_fields=['tags_sort'], raw=False, using=sign._state.db)
+
+    if changed:
+        # tags are part of the search index and the api
+        request_reindex(changed.keys())
+    return changed
+
+def rebuild_tags_sort(project):
+    """ Recompute tags_sort for a whole project """
+    return refresh_tags_sort(Sign.objects.filter(project=project).values_list('id', flat=True))
+
 def tags_changed(sender, **kwargs):
-    # invalidate cached tags_sort
+    """ keep tags_sort up to date (see refresh_tags_sort) """
     instance = kwargs.get('instance')
     reverse = kwargs.get('reverse')
-    # print "hey!", instance, type(instance), reverse
+    action = kwargs.get('action')
 
     if reverse:
-        # instance is a tag?
-        for sign in instance.signs.all():
-            sign.tags_sort = ", ".join(sign.tag_list())
-            sign.save()
-    else:
+        # instance is a tag
+        if action == 'pre_clear':
+            instance._cleared_sign_ids = list(instance.signs.values_list('id', flat=True))
+        elif action == 'post_clear':
+            refresh_tags_sort(getattr(instance, '_cleared_sign_ids', []))
+        elif action in ('post_add', 'post_remove'):
+            refresh_tags_sort(kwargs.get('pk_set') or [])
+    elif action in ('post_add', 'post_remove', 'post_clear'):
         # instance is a sign
-        instance.tags_sort = ", ".join(instance.tag_list())
-        instance.save()
+        changed = refresh_tags_sort([instance.id])
+        if instance.id in changed:
+            instance.tags_sort = changed[instance.id]
 models.signals.m2m_changed.connect(tags_changed, sender=Sign.tags.through)
 
+def tag_saved(sender, **kwargs):
+    """ Tag post save. A renamed tag changes the tags_sort of its signs """
+    instance = kwargs.get('instance')
+    if not kwargs.get('created'):
+        refresh_tags_sort(instance.signs.values_list('id', flat=True))
+models.signals.post_save.connect(tag_saved, sender="tag.Tag")
+
+_related_models = {}
+
+def related_model(name):
+    """ Models from other apps that we only know through their relations to Sign.
+        (These have to be looked up once the app registry is ready.)
+    """
+    if not _related_models:
+        SignTemplate = Sign._meta.get_field('sign_template').related_model
+        _related_models.update({
+            'SignTemplate': SignTemplate,
+            'SignTemplateAttribute': SignTemplate._meta.get_field('sign_template_attributes').related_model,
+            'AttributeInstance': Sign._meta.get_field('attribute_instances').related_model,
+            'SignMessage': Sign._meta.get_field('sign_messages').related_model,
+            'Zone': Sign._meta.get_field('zone').related_model,
+            'Project': Sign._meta.get_field('project').related_model,
+        })
+    return _related_models[name]
+
+def attribute_instance_owner(instance):
+    """ the kind of object an attribute instance belongs to:
+        "sign", "sign_message", "position", "zone", "sign_template", "project" (or None)
+    """
+    owners = {
+        ContentType.objects.get_for_model(Sign).id: "sign",
+        ContentType.objects.get_for_model(related_model('SignMessage')).id: "sign_message",
+        ContentType.objects.get_for_model(Position).id: "position",
+        ContentType.objects.get_for_model(related_model('Zone')).id: "zone",
+        ContentType.objects.get_for_model(related_model('SignTemplate')).id: "sign_template",
+        ContentType.objects.get_for_model(related_model('Project')).id: "project",
+    }
+    return owners.get(instance.content_type_id)
+
+def generations_changed(sender, **kwargs):
+    """ Any model post save/delete. Bump the generation of the object that changed (see generations).
+        This invalidates everything derived from it: the CompiledSignTemplate of a sign template, and
+        the cached labels, summaries and pngs of the signs that inherit from it.
+    """
+    instance = kwargs.get('instance')
+    if sender is related_model('SignTemplate'):
+        bump_generation("sign_template", instance.id)
+    elif sender is related_model('SignTemplateAttribute'):
+        bump_generation("sign_template", instance.sign_template_id)
+    elif sender is Position:
+        bump_generation("position", instance.id)
+    elif sender is related_model('Zone'):
+        bump_generation("zone", instance.id)
+    elif sender is related_model('Project'):
+        bump_generation("project", instance.id)
+    elif sender is related_model('SignMessage'):
+        bump_generation("sign", instance.sign_id)
+    elif sender is related_model('AttributeInstance'):
+        owner = attribute_instance_owner(instance)
+        if owner == "sign_message":
+            for sign_id in related_model('SignMessage').objects.filter(id=instance.object_id).values_list('sign_id', flat=True):
+                bump_generation("sign", sign_id)
+        elif owner:
+            bump_generation(owner, instance.object_id)
+models.signals.post_save.connect(generations_changed, dispatch_uid='sign:generations_changed')
+models.signals.post_delete.connect(generations_changed, dispatch_uid='sign:generations_changed')
+
+def search_index_changed(sender, **kwargs):
+    """ Any model post save/delete. Reindex a sign when its attribute instances or messages change """
+    instance = kwargs.get('instance')
+    if sender is related_model('AttributeInstance'):
+        if instance.content_type_id == ContentType.objects.get_for_model(Sign).id:
+            request_reindex([instance.object_id])
+        elif instance.content_type_id == ContentType.objects.get_for_model(related_model('SignMessage')).id:
+            request_reindex(related_model('SignMessage').objects.filter(id=instance.object_id).values_list('sign_id', flat=True))
+    elif sender is related_model('SignMessage'):
+        request_reindex([instance.sign_id])
+models.signals.post_save.connect(search_index_changed, dispatch_uid='sign:search_index_changed')
+models.signals.post_delete.connect(search_index_changed, dispatch_uid='sign:search_index_changed')
+
+def api_json_changed(sender, **kwargs):
+    """ Any model post save/delete. Refresh the stored api json of the signs that inherit from a changed
+        zone, position, sign template, or their attribute instances
+    """
+    instance = kwargs.get('instance')
+    if sender is related_model('AttributeInstance'):
+        owner = attribute_instance_owner(instance)
+        if owner:
+            request_api_json_refresh(owner, [instance.object_id])
+    elif sender is related_model('SignMessage'):
+        request_api_json_refresh("sign", [instance.sign_id])
+    elif sender is related_model('SignTemplateAttribute'):
+        request_api_json_refresh("sign_template", [instance.sign_template_id])
+    elif sender is related_model('SignTemplate') or sender is related_model('Zone'):
+        # a new zone or sign template has no signs yet
+        if not kwargs.get('created'):
+            request_api_json_refresh("sign_template" if sender is related_model('SignTemplate') else "zone", [instance.id])
+models.signals.post_save.connect(api_json_changed, dispatch_uid='sign:api_json_changed')
+models.signals.post_delete.connect(api_json_changed, dispatch_uid='sign:api_json_changed')
+
 def clean_up_position(sender, **kwargs):
     """ Sign post delete clean up position if it has no other signs """
     sign = kwargs.get('instance')
@@ -1416,20 +2866,895 @@ def clean_up_position(sender, **kwargs):
         sign.position.delete()
 models.signals.post_delete.connect(clean_up_position, sender=Sign)
 
+def clean_up_conflicts(sender, **kwargs):
+    """ Sign post delete, remove the highlighting from a sign that is no longer duplicated """
+    sign = kwargs.get('instance')
+    refresh_conflict_groups(sign.project_id, [sign.conflict_key()])
+models.signals.post_delete.connect(clean_up_conflicts, sender=Sign)
+
+def generations(pairs):
+    """ Return {(kind, id): generation} for a list of (kind, id) pairs. Generations are counters kept
+        in the cache, they are bumped whenever the object changes (see bump_generation).
+        A missing counter starts at the current time in ms, so that an evicted counter never goes backwards.
+    """
+    keys = OrderedDict((_generation_key(kind, obj_id), (kind, obj_id)) for kind, obj_id in pairs)
+    values = cache.get_many(keys.keys())
+    result = {}
+    for key, pair in keys.items():
+        if key not in values:
+            cache.add(key, int(time.time() * 1000), None)
+            values[key] = cache.get(key)
+        result[pair] = values[key]
+    return result
+
+def generation(kind, obj_id):
+    return generations([(kind, obj_id)])[(kind, obj_id)]
+
+def bump_generation(kind, obj_id):
+    """ invalidate everything derived from an object, see generations() """
+    key = _generation_key(kind, obj_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), None)
+
+def _generation_key(kind, obj_id):
+    return "sign_generation:{0}:{1}".format(kind, obj_id)
+
+# values cached per sign, see derived_get_many
+DERIVED_FAMILIES = ("sign_unicode", "sign_message_summary", "sign_meta_summary", "sign_svg_as_png")
+
+def derived_dependencies(sign):
+    """ the (kind, id) objects whose generations a sign's cached values depend on """
+    return [
+        ("sign", sign.id),
+        ("position", sign.position_id),
+        ("zone", sign.zone_id),
+        ("sign_template", sign.sign_template_id),
+        ("project", sign.project_id),
+    ]
+
+def derived_get_many(families, signs):
+    """ Fetch values cached per sign (see DERIVED_FAMILIES) along with the generations they depend on, in
+        a single cache round trip. A value is stored with the signature (the dependency generations) it was
+        built from, so bumping the generation of a zone, say, invalidates every sign in it at once.
+        Hits, misses and stale values are counted per family (buffered in the process), see derived_cache_stats().
+
+        returns ({family: {sign id: value}}, {sign id: signature}), the signatures are for derived_set_many
+    """
+    signs = [sign for sign in signs if sign.id]
+    value_keys = OrderedDict()
+    for family in families:
+        for sign in signs:
+            value_keys["{0}:{1}".format(family, sign.id)] = (family, sign.id)
+    pairs = OrderedDict.fromkeys(pair for sign in signs for pair in derived_dependencies(sign))
+    generation_keys = OrderedDict((_generation_key(kind, obj_id), (kind, obj_id)) for kind, obj_id in pairs)
+
+    values = cache.get_many(value_keys.keys() + generation_keys.keys())
+    current = dict((pair, values[key]) for key, pair in generation_keys.items() if key in values)
+    missing = [pair for key, pair in generation_keys.items() if key not in values]
+    if missing:
+        current.update(generations(missing))
+    signatures = dict((sign.id, tuple(current[pair] for pair in derived_dependencies(sign))) for sign in signs)
+
+    hits = dict((family, {}) for family in families)
+    outcomes = {}
+    for key, (family, sign_id) in value_keys.items():
+        entry = values.get(key)
+        if entry is None:
+            outcome = "miss"
+        elif isinstance(entry, tuple) and len(entry) == 2 and entry[0] == signatures[sign_id]:
+            hits[family][sign_id] = entry[1]
+            outcome = "hit"
+        else:
+            # built from older generations (or cached before signatures were used)
+            outcome = "stale"
+        outcomes[(family, outcome)] = outcomes.get((family, outcome), 0) + 1
+    for (family, outcome), count in outcomes.items():
+        incr_stat_buffered("cache:{0}:{1}".format(family, outcome), count)
+    return hits, signatures
+
+def derived_get(family, sign):
+    """ derived_get_many for one value, returns (value or None, signature) """
+    hits, signatures = derived_get_many([family], [sign])
+    return hits[family].get(sign.id), signatures.get(sign.id)
+
+def derived_set_many(family, signatures, values):
+    """ cache {sign id: value} with the signatures returned by derived_get_many """
+    if values:
+        cache.set_many(dict(("{0}:{1}".format(family, sign_id), (signatures[sign_id], value)) for sign_id, value in values.items()), None)
+
+def derived_set(family, sign_id, signature, value):
+    derived_set_many(family, {sign_id: signature}, {sign_id: value})
+
+def derived_cache_stats(families=DERIVED_FAMILIES):
+    """ {family: {'hit': n, 'miss': n, 'stale': n, 'hit_rate': fraction}} """
+    names = ["cache:{0}:{1}".format(family, outcome) for family in families for outcome in ("hit", "miss", "stale")]
+    stats = get_stats(names)
+    result = OrderedDict()
+    for family in families:
+        counts = OrderedDict((outcome, stats["cache:{0}:{1}".format(family, outcome)]) for outcome in ("hit", "miss", "stale"))
+        total = sum(counts.values())
+        counts['hit_rate'] = float(counts['hit']) / total if total else None
+        result[family] = counts
+    return result
+
+class CompiledSignTemplate(object):
+    """ Everything the render paths need to know about a sign template, worked out once per template
+        version (see compiled_sign_template)
+    """
+    # these keys are added by Sign.attributes() rather than coming from attribute instances
+    SYNTHETIC_KEYS = set(['sign_template', 'number', 'sign_id', 'type.short_code_combo', 'location.short_code_combo',
+                          'last_modified_date', 'last_modified_year', 'last_modified_month', 'last_modified_day'])
+    G_TAG_RE = re.compile(r"<g [^\n]*")
+    G_ID_RE = re.compile(r"id\w*?=\w*?['\"]([^'\"]*)['\"]")
+    PLACEHOLDER_RE = re.compile(r"\{ ?([^{}\s]+) ?\}")
+
+    def __init__(self, sign_template):
+        self.sign_template_id = sign_template.id
+        stas = list(sign_template.sign_template_attributes.all().select_related('attribute'))
+        self.svg_attributes = [sta.attribute for sta in stas if not sta.is_repeating and sta.attribute.group == 'message']
+        self.repeating_attributes = [sta.attribute for sta in stas if sta.is_repeating]
+        self.side_dict = sign_template.side_dict()
+        self.column_dict = sign_template.column_dict()
+        self.number_of_sides = int(sign_template.number_of_sides)
+        self.number_of_columns = sign_template.number_of_columns
+        self.number_of_messages = sign_template.number_of_messages
+
+        if sign_template.svg_code:
+            self.svg_template = sign_template.svg_code_w_fonts()
+            self.fonts_list = sign_template.fonts_list()
+            self.width, self.height = get_dimensions_of_svg(self.svg_template)
+        else:
+            self.svg_template = ""
+            self.fonts_list = []
+            self.width, self.height = None, None
+
+        # ids of the <g> tags, like `<g id='level'>`
+        self.g_ids = set()
+        for g_tag in self.G_TAG_RE.findall(self.svg_template):
+            self.g_ids.update(self.G_ID_RE.findall(g_tag))
+        # placeholders, like `{level}`
+        self.placeholders = set(self.PLACEHOLDER_RE.findall(self.svg_template))
+        self._static_template = None
+
+        # Bill's comprehensive `<g id='level'>` templates need to be expanded by node
+        # look for a tag with `id='repeat'`, or tags like `id='level'`
+        self.use_expander = bool(
+            'repeat' in self.g_ids or
+            self.g_ids & self.SYNTHETIC_KEYS or
+            (self.g_ids and Attribute.objects.filter(slug__in=self.g_ids).exists())
+            )
+
+    def static_template(self):
+        """ the SvgTemplate for the unexpanded svg, parsed on first use """
+        if self._static_template is None:
+            self._static_template = SvgTemplate(svg_ascii(self.svg_template))
+        return self._static_template
+
+    def size(self):
+        """ roughly the bytes held: the template svg, and the parsed copy once there is one """
+        size = len(self.svg_template)
+        if self._static_template is not None:
+            # its text, and the same text again in segments
+            size += 2 * len(self._static_template.text)
+        return size
+
+def svg_ascii(template):
+    """ This is a fix to funny characters like the "e" with the thingy on top
+        This may have un-intended effect for certain edge case characters
+    """
+    if type(template) == type(str()):
+        template = unicode(template, "utf-8", errors="ignore")
+    return template.encode('ascii', 'xmlcharrefreplace')
+
+class SvgTemplate(object):
+    """ A static svg template, parsed once into text and `{key}` / `{ key }` placeholders.
+        render() substitutes every value in a single pass, with the same semantics as Sign.myreplace:
+        None becomes an empty string, and unknown placeholders are left alone.
+    """
+    PLACEHOLDER_RE = re.compile(r"\{ ([^{}]+?) \}|\{([^{}]+?)\}")
+
+    def __init__(self, text):
+        self.text = text
+        # alternating literal text and (key, placeholder text)
+        self.segments = []
+        self.placeholders = set()
+        position = 0
+        for match in self.PLACEHOLDER_RE.finditer(text):
+            key = match.group(1) if match.group(1) is not None else match.group(2)
+            self.segments.append(text[position:match.start()])
+            self.segments.append((key, match.group(0)))
+            self.placeholders.add(key)
+            position = match.end()
+        self.segments.append(text[position:])
+
+    def render(self, values):
+        parts = []
+        for i, segment in enumerate(self.segments):
+            if i % 2:
+                key, placeholder = segment
+                if key in values:
+                    value = values[key]
+                    parts.append("" if value is None else value)
+                else:
+                    parts.append(placeholder)
+            else:
+                parts.append(segment)
+        return "".join(parts)
+
+_compiled_templates = OrderedDict()
+_compiled_templates_lock = threading.Lock()
+
+def compiled_sign_template(sign_template):
+    """ return the CompiledSignTemplate for the current version of a sign template.
+        These are kept (per process) in a small LRU, because the template svg can be too big for the cache.
+        The LRU is bounded by SIGN_TEMPLATE_ARTIFACT_CACHE_SIZE entries and, since a template can be several MB,
+        by SIGN_TEMPLATE_ARTIFACT_CACHE_BYTES (see CompiledSignTemplate.size). The newest entry is always kept.
+    """
+    version = generation("sign_template", sign_template.id)
+    max_age = getattr(settings, 'SIGN_TEMPLATE_ARTIFACT_MAX_AGE', 3600)
+    with _compiled_templates_lock:
+        entry = _compiled_templates.pop(sign_template.id, None)
+        if entry and entry[0] == version and entry[1] > time.time() - max_age:
+            _compiled_templates[sign_template.id] = entry
+            return entry[2]
+
+    compiled = CompiledSignTemplate(sign_template)
+    with _compiled_templates_lock:
+        _compiled_templates[sign_template.id] = (version, time.time(), compiled)
+        max_entries = getattr(settings, 'SIGN_TEMPLATE_ARTIFACT_CACHE_SIZE', 64)
+        max_bytes = getattr(settings, 'SIGN_TEMPLATE_ARTIFACT_CACHE_BYTES', 64 * 1024 * 1024)
+        # sizes grow when a template is first parsed, so they are added up again each time
+        total = sum(entry[2].size() for entry in _compiled_templates.values())
+        while len(_compiled_templates) > 1 and (len(_compiled_templates) > max_entries or total > max_bytes):
+            unused, evicted = _compiled_templates.popitem(last=False)
+            total -= evicted[2].size()
+    return compiled
+
+def incr_stat(name, delta=1):
+    """ increment a shared (cross process) counter. see get_stats() """
+    if not delta:
+        return
+    key = "sign_stats:%s" % name
+    # the counter usually exists, so this is a single round trip
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        if not cache.add(key, delta, None):
+            # someone else created it in between
+            cache.incr(key, delta)
+
+_buffered_stats = {}
+_buffered_stats_lock = threading.Lock()
+_buffered_stats_flushed = [time.time()]
+
+def incr_stat_buffered(name, delta=1):
+    """ incr_stat for counters on hot paths (eg. every sign label lookup): counted in this process and added to
+        the shared counters every SIGN_STATS_FLUSH_INTERVAL seconds, so counting costs no cache round trip.
+        (up to an interval's counts of a process are lost when it exits)
+    """
+    if not delta:
+        return
+    with _buffered_stats_lock:
+        _buffered_stats[name] = _buffered_stats.get(name, 0) + delta
+        if time.time() - _buffered_stats_flushed[0] < getattr(settings, 'SIGN_STATS_FLUSH_INTERVAL', 10):
+            return
+        counts = dict(_buffered_stats)
+        _buffered_stats.clear()
+        _buffered_stats_flushed[0] = time.time()
+    for name, count in counts.items():
+        incr_stat(name, count)
+
+def get_stats(names):
+    """ return an OrderedDict of counter values, see incr_stat() """
+    values = cache.get_many(["sign_stats:%s" % name for name in names])
+    return OrderedDict((name, values.get("sign_stats:%s" % name, 0)) for name in names)
+
+_commit_batches = threading.local()
+
+def on_commit_batch(name, items, callback):
+    """ Collect `items` for the current transaction and call `callback(items)` once, when it commits.
+        Outside of a transaction the callback is called straight away.
+    """
+    if not connection.in_atomic_block:
+        callback(list(items))
+        return
+    batches = getattr(_commit_batches, 'batches', None)
+    if batches is None:
+        batches = _commit_batches.batches = {}
+    batch = batches.get(name)
+    # a rolled back transaction discards our callback, along with the batch
+    if batch is None or not any(entry[1] is batch['flush'] for entry in connection.run_on_commit):
+        def flush():
+            if batches.get(name) is batch:
+                del batches[name]
+            callback(batch['items'])
+        batch = batches[name] = {'items': [], 'flush': flush}
+        transaction.on_commit(flush)
+    batch['items'].extend(items)
+
+def artwork_priority(count):
+    """ The render priority class (see render_slot) of an artwork job for `count` signs, when it wasn't given:
+        "bulk" above SIGN_ARTWORK_BULK_THRESHOLD signs, so a large regeneration can't crowd out the saves.
+    """
+    if count > getattr(settings, 'SIGN_ARTWORK_BULK_THRESHOLD', 50):
+        return "bulk"
+    return "recent_save"
+
+def request_artwork(sign_ids, delay_seconds=30, priority=None):
+    """ Ask for the artwork of some signs to be regenerated, in the background.
+
+        Requests made within a transaction are sent as a single job when it commits, and a sign
+        that is already waiting on a job is coalesced into that job rather than being sent again.
+        `artwork_stats()` reports the requested/enqueued/coalesced/executed counts.
+        `priority` is the job's render priority class (see render_slot), worked out from the number of signs
+        when it isn't given (see artwork_priority).
+    """
+    sign_ids = [sign_id for sign_id in sign_ids if sign_id]
+    if not sign_ids:
+        return
+    if priority is None:
+        priority = artwork_priority(len(sign_ids))
+    incr_stat("artwork:requested", len(sign_ids))
+    on_commit_batch("sign:generate_artwork:%s" % priority, sign_ids, lambda ids: _send_artwork_job(ids, delay_seconds, priority))
+
+def _artwork_pending_key(sign_id, priority):
+    return "sign_artwork_pending:{0}:{1}".format(priority, sign_id)
+
+def _send_artwork_job(sign_ids, delay_seconds, priority):
+    sign_ids = list(OrderedDict.fromkeys(sign_ids))
+    # a sign is only coalesced into a job of the same, or a higher, priority
+    if priority in RENDER_PRIORITIES:
+        covering = RENDER_PRIORITIES[:RENDER_PRIORITIES.index(priority) + 1]
+    else:
+        covering = (priority,)
+    pending = cache.get_many([_artwork_pending_key(sign_id, p) for sign_id in sign_ids for p in covering])
+    new_ids = [sign_id for sign_id in sign_ids if not any(_artwork_pending_key(sign_id, p) in pending for p in covering)]
+    incr_stat("artwork:coalesced", len(sign_ids) - len(new_ids))
+    if new_ids:
+        # pending until the job starts. the timeout is a safety net for jobs that never run
+        cache.set_many(dict((_artwork_pending_key(sign_id, priority), 1) for sign_id in new_ids), delay_seconds + 300)
+        jobber.send(name='sign:generate_artwork', sign_ids=new_ids, delay_seconds=delay_seconds, priority=priority)
+        incr_stat("artwork:enqueued", len(new_ids))
+
+def artwork_stats():
+    return get_stats(["artwork:requested", "artwork:enqueued", "artwork:coalesced", "artwork:executed"])
+
+_node_session = None
+_node_session_lock = threading.Lock()
+
+def node_session():
+    """ A shared requests session, so that calls to node reuse (pooled) keep-alive connections """
+    global _node_session
+    if _node_session is None:
+        with _node_session_lock:
+            if _node_session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, getattr(settings, 'SIGN_ARTWORK_WORKERS', 4)))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _node_session = session
+    return _node_session
+
+class RenderError(Exception):
+    """ node couldn't render some artwork """
+
+class NodeRenderError(RenderError):
+    """ node failed: it timed out, refused the connection, or returned an error status """
+
+class NodeUnavailable(NodeRenderError):
+    """ node has been failing, so the circuit breaker didn't even try (see node_render) """
+
+class MalformedArtwork(RenderError):
+    """ node answered, but with an (almost) empty document. Usually a malformed template """
+
+# node's responses shorter than this are empty documents
+MIN_ARTWORK_LENGTH = 150
+
+def node_render(endpoint, data=None, method="post", retries=None):
+    """ Call node (`endpoint` is "expand", "convert_png" or "version"), returns the response.
+
+        - connect/read timeouts (SIGN_NODE_CONNECT_TIMEOUT, SIGN_NODE_READ_TIMEOUT)
+        - connection errors, timeouts and 5xx responses are retried up to SIGN_NODE_RETRIES times,
+          with a jittered exponential backoff (SIGN_NODE_RETRY_BACKOFF)
+        - a circuit breaker: after SIGN_NODE_CIRCUIT_THRESHOLD failed calls within a minute, calls fail fast
+          with NodeUnavailable for SIGN_NODE_CIRCUIT_COOLDOWN seconds. Then a single call (the probe, without
+          retries) is let through while the others keep failing fast: if node answers the circuit closes,
+          otherwise it opens for another cooldown.
+        - a response shorter than MIN_ARTWORK_LENGTH (other than for "version") raises MalformedArtwork
+
+        Calls, errors, retries, malformed results and latency are counted per endpoint, see node_stats()
+    """
+    cooldown = getattr(settings, 'SIGN_NODE_CIRCUIT_COOLDOWN', 30)
+    default_retries, timeout, backoff = node_timeouts()
+    probing = False
+    if cache.get("node_circuit:open"):
+        incr_stat("node:%s:short_circuit" % endpoint)
+        raise NodeUnavailable("node has been failing, not calling /{0}/".format(endpoint))
+    if cache.get("node_circuit:half_open"):
+        # the cooldown is over, but node hasn't answered since. only one call finds out
+        if not cache.add("node_circuit:probe", 1, max_render_seconds()):
+            incr_stat("node:%s:short_circuit" % endpoint)
+            raise NodeUnavailable("node has been failing, another call is trying /{0}/".format(endpoint))
+        probing = True
+        retries = 0
+    if retries is None:
+        retries = default_retries
+    url = "{0}/{1}/".format(settings.NODE_DOMAIN, endpoint)
+
+    error = None
+    for attempt in range(retries + 1):
+        if attempt:
+            incr_stat("node:%s:retry" % endpoint)
+            time.sleep(random.uniform(0, backoff * 2 ** (attempt - 1)))
+        started = time.time()
+        incr_stat("node:%s:call" % endpoint)
+        try:
+            r = node_session().request(method, url, data=data, headers=settings.NODE_HEADERS, timeout=timeout)
+            r.content       # read it all within the timeout
+        except requests.Timeout as e:
+            incr_stat("node:%s:timeout" % endpoint)
+            error = NodeRenderError("node timed out on /{0}/: {1}".format(endpoint, e))
+            continue
+        except requests.RequestException as e:
+            incr_stat("node:%s:error" % endpoint)
+            error = NodeRenderError("node failed on /{0}/: {1}".format(endpoint, e))
+            continue
+        finally:
+            incr_stat("node:%s:latency_ms" % endpoint, int((time.time() - started) * 1000))
+
+        if r.status_code >= 500:
+            incr_stat("node:%s:error" % endpoint)
+            error = NodeRenderError("node returned {0} on /{1}/".format(r.status_code, endpoint))
+            continue
+        # node answered, so it's healthy
+        cache.delete("node_circuit:failures")
+        if probing:
+            cache.delete_many(["node_circuit:half_open", "node_circuit:probe"])
+        if r.status_code >= 400:
+            incr_stat("node:%s:error" % endpoint)
+            raise NodeRenderError("node returned {0} on /{1}/".format(r.status_code, endpoint))
+        if endpoint != "version" and len(r.content) <= MIN_ARTWORK_LENGTH:
+            incr_stat("node:%s:malformed" % endpoint)
+            raise MalformedArtwork("node returned an empty document on /{0}/: {1!r}".format(endpoint, r.content))
+        return r
+
+    # every attempt failed
+    if probing:
+        cache.set("node_circuit:open", 1, cooldown)
+        cache.delete("node_circuit:probe")
+        incr_stat("node:circuit_opened")
+        raise error
+    key = "node_circuit:failures"
+    if not cache.add(key, 1, 60):
+        try:
+            failures = cache.incr(key)
+        except ValueError:
+            failures = 1
+            cache.set(key, failures, 60)
+    else:
+        failures = 1
+    if failures >= getattr(settings, 'SIGN_NODE_CIRCUIT_THRESHOLD', 5):
+        cache.set("node_circuit:open", 1, cooldown)
+        # after the cooldown, until a probe gets an answer. the timeout is a safety net
+        cache.set("node_circuit:half_open", 1, cooldown + 3600)
+        cache.delete(key)
+        incr_stat("node:circuit_opened")
+    raise error
+
+def node_timeouts():
+    """ returns (retries, (connect timeout, read timeout), retry backoff) for node_render """
+    return (
+        getattr(settings, 'SIGN_NODE_RETRIES', 2),
+        (getattr(settings, 'SIGN_NODE_CONNECT_TIMEOUT', 3.05), getattr(settings, 'SIGN_NODE_READ_TIMEOUT', 30)),
+        getattr(settings, 'SIGN_NODE_RETRY_BACKOFF', 0.5),
+    )
+
+def max_render_seconds():
+    """ The longest a render can take: an expand and a convert_png, each with every attempt timing out.
+        Render locks and slots have to outlive this, or a second render can start while the first is still running.
+    """
+    retries, (connect, read), backoff = node_timeouts()
+    per_call = (retries + 1) * (connect + read) + sum(backoff * 2 ** i for i in range(retries))
+    return int(2 * per_call) + 30
+
+NODE_ENDPOINTS = ("expand", "convert_png", "version")
+
+def node_stats():
+    """ node_render's counters per endpoint, with the average latency """
+    outcomes = ("call", "retry", "timeout", "error", "malformed", "short_circuit", "latency_ms")
+    stats = get_stats(["node:{0}:{1}".format(endpoint, outcome) for endpoint in NODE_ENDPOINTS for outcome in outcomes] + ["node:circuit_opened"])
+    result = OrderedDict()
+    for endpoint in NODE_ENDPOINTS:
+        counts = OrderedDict((outcome, stats["node:{0}:{1}".format(endpoint, outcome)]) for outcome in outcomes)
+        counts['average_ms'] = float(counts['latency_ms']) / counts['call'] if counts['call'] else None
+        result[endpoint] = counts
+    result['circuit_opened'] = stats["node:circuit_opened"]
+    result['circuit_open'] = bool(cache.get("node_circuit:open"))
+    result['circuit_half_open'] = not result['circuit_open'] and bool(cache.get("node_circuit:half_open"))
+    return result
+
+class RenderQueueTimeout(NodeUnavailable):
+    """ we waited too long for a render slot (see render_slot) """
+
+# highest priority first
+RENDER_PRIORITIES = ("interactive", "recent_save", "bulk")
+
+_render_priority = threading.local()
+
+@contextmanager
+def render_priority(priority, project_id=None):
+    """ set the render priority class (and project, for its fair share) of the renders in this thread.
+        Renders without one (eg. a form preview, in a request) are "interactive"
+    """
+    previous = getattr(_render_priority, 'value', None)
+    _render_priority.value = (priority, project_id)
+    try:
+        yield
+    finally:
+        _render_priority.value = previous
+
+def render_slot_limits():
+    """ (total slots, {priority: slots it may use}, {priority: max seconds to wait}, per project share) """
+    total = getattr(settings, 'SIGN_RENDER_SLOTS', 8)
+    caps = getattr(settings, 'SIGN_RENDER_SLOT_CAPS', {"interactive": total, "recent_save": max(1, total * 3 // 4), "bulk": max(1, total // 2)})
+    waits = getattr(settings, 'SIGN_RENDER_SLOT_WAIT', {"interactive": 10, "recent_save": 60, "bulk": 600})
+    project_share = getattr(settings, 'SIGN_RENDER_PROJECT_SHARE', 0.5)
+    return total, caps, waits, project_share
+
+def _take_slot(prefix, count, token, ttl):
+    for i in range(count):
+        key = "{0}:{1}".format(prefix, i)
+        if cache.add(key, token, ttl):
+            return key
+    return None
+
+def _release_slot(key, token):
+    if key and cache.get(key) == token:
+        cache.delete(key)
+
+def _waiting_projects(priority):
+    """ {project id: expiry} of the projects with a render waiting for a slot in a priority class """
+    now = time.time()
+    waiting = cache.get("render_queue:%s:projects" % priority) or {}
+    return dict((project_id, expiry) for project_id, expiry in waiting.items() if expiry > now)
+
+def _mark_waiting_project(priority, project_id):
+    # not atomic, a waiter lost to a race puts itself back on its next try
+    waiting = _waiting_projects(priority)
+    waiting[project_id] = time.time() + 2
+    cache.set("render_queue:%s:projects" % priority, waiting, 5)
+
+@contextmanager
+def render_slot(project_id=None):
+    """ Wait for one of the SIGN_RENDER_SLOTS (the concurrency cap toward node, across every process)
+        before rendering. Slots are taken by priority class (see render_priority):
+        - each class may only use its own share of the slots (SIGN_RENDER_SLOT_CAPS), so interactive
+          previews always have slots that bulk regeneration can't fill
+        - a class doesn't take a slot while a higher class is waiting for one
+        - while another project is waiting in the same class, a project may hold at most SIGN_RENDER_PROJECT_SHARE
+          of the class' slots, so a big project's regeneration doesn't starve the others. With nobody else
+          waiting it may use them all
+        Slots expire (after max_render_seconds, or SIGN_RENDER_SLOT_TTL if that's longer) in case their worker dies.
+        Raises RenderQueueTimeout after SIGN_RENDER_SLOT_WAIT seconds. Queue depth and wait time are
+        counted per class, see render_scheduler_stats()
+    """
+    priority, thread_project_id = getattr(_render_priority, 'value', None) or ("interactive", None)
+    if project_id is None:
+        project_id = thread_project_id
+    total, caps, waits, project_share = render_slot_limits()
+    cap = min(total, caps.get(priority, total))
+    project_cap = max(1, int(cap * project_share))
+    higher = RENDER_PRIORITIES[:RENDER_PRIORITIES.index(priority)] if priority in RENDER_PRIORITIES else ()
+    ttl = max(getattr(settings, 'SIGN_RENDER_SLOT_TTL', 0), max_render_seconds())
+    token = uuid.uuid4().hex
+
+    started = time.time()
+    deadline = started + waits.get(priority, 60)
+    queued = False
+    slot_key = project_key = None
+    try:
+        while True:
+            # waiting classes keep a short lived "waiting" key alive, so a dead waiter can't block anyone
+            if not higher or not cache.get_many(["render_queue:%s:waiting" % p for p in higher]):
+                over_share = False
+                if project_id is not None and priority != "interactive":
+                    # the project's share is taken even when it isn't needed, so it counts once others queue up
+                    project_key = _take_slot("render_slot:project:{0}:{1}".format(project_id, priority), project_cap, token, ttl)
+                    over_share = not project_key and any(p != project_id for p in _waiting_projects(priority))
+                if not over_share:
+                    slot_key = _take_slot("render_slot", cap, token, ttl)
+                    if slot_key:
+                        break
+                    _release_slot(project_key, token)
+                    project_key = None
+            if not queued:
+                queued = True
+                incr_stat("render_queue:%s:depth" % priority)
+            cache.set("render_queue:%s:waiting" % priority, 1, 2)
+            if priority != "interactive":
+                _mark_waiting_project(priority, project_id)
+            if time.time() >= deadline:
+                incr_stat("render_queue:%s:timeout" % priority)
+                raise RenderQueueTimeout("no render slot for a {0} render after {1:.0f}s".format(priority, time.time() - started))
+            time.sleep(random.uniform(0.05, 0.15))
+    finally:
+        if queued:
+            incr_stat("render_queue:%s:depth" % priority, -1)
+    incr_stat("render_queue:%s:started" % priority)
+    incr_stat("render_queue:%s:wait_ms" % priority, int((time.time() - started) * 1000))
+
+    try:
+        yield
+    finally:
+        _release_slot(slot_key, token)
+        _release_slot(project_key, token)
+
+def render_scheduler_stats():
+    """ per priority class: the renders started, how many are waiting now, their average wait, and timeouts """
+    outcomes = ("started", "depth", "wait_ms", "timeout")
+    stats = get_stats(["render_queue:{0}:{1}".format(p, outcome) for p in RENDER_PRIORITIES for outcome in outcomes])
+    result = OrderedDict()
+    for p in RENDER_PRIORITIES:
+        counts = OrderedDict((outcome, stats["render_queue:{0}:{1}".format(p, outcome)]) for outcome in outcomes)
+        counts['average_wait_ms'] = float(counts['wait_ms']) / counts['started'] if counts['started'] else None
+        result[p] = counts
+    return result
+
+def _render_artwork(args):
+    """ generate_artwork worker, args are (signs, priority class).
+        returns a list of (sign id, exception) for the signs that failed
+    """
+    signs, priority = args
+    errors = []
+    try:
+        for sign in signs:
+            try:
+                with render_priority(priority, sign.project_id):
+                    sign.svg_as_png(fallback=False)
+            except Exception as e:
+                errors.append((sign.id, e))
+    finally:
+        # each worker thread has its own db connection
+        connection.close()
+    return errors
+
 def generate_artwork(**kwargs):
     """ generate sign artwork
-        `job = jobber.send(name='sign:generate_artwork', sign_ids=[self.id,])`
+        `job = jobber.send(name='sign:generate_artwork', sign_ids=[self.id,], priority="bulk")`
+
+        Signs are rendered in chunks, each chunk is shared between a bounded pool of worker threads.
     """
     print "Generating artwork..."
-    sign_ids = kwargs.pop('sign_ids')
-    st_code_results = {}
-    for sign in Sign.objects.filter(id__in=sign_ids):
-        # print sign
-        # check whether this sign_type has artwork.
-        if sign.sign_template_id not in st_code_results:
-            st_code_results[sign.sign_template_id] = bool(sign.sign_template.svg_code)
-
-        if st_code_results[sign.sign_template_id]:
-            sign.svg_as_png()
+    sign_ids = sorted(set(kwargs.pop('sign_ids')))
+    # jobs sent without a priority (or before there were priorities) get one from their size
+    priority = kwargs.pop('priority', None) or artwork_priority(len(sign_ids))
+    # changes from here on need a new job
+    cache.delete_many([_artwork_pending_key(sign_id, priority) for sign_id in sign_ids])
+    workers = getattr(settings, 'SIGN_ARTWORK_WORKERS', 4)
+    chunk_size = getattr(settings, 'SIGN_ARTWORK_CHUNK_SIZE', 100)
+
+    # only signs whose sign_type has artwork. The templates are loaded once and shared, rather than
+    # joined onto every sign row (svg_code is large).
+    SignTemplate = Sign._meta.get_field('sign_template').related_model
+    sign_templates = SignTemplate.objects.filter(signs__id__in=sign_ids).exclude(svg_code="").exclude(svg_code__isnull=True).distinct()
+    sign_templates = dict((st.id, st) for st in sign_templates)
+
+    pool = ThreadPool(workers)
+    started = time.time()
+    rendered = 0
+    errors = []
+    num_chunks = (len(sign_ids) + chunk_size - 1) // chunk_size
+    try:
+        for chunk_num, i in enumerate(range(0, len(sign_ids), chunk_size)):
+            chunk_started = time.time()
+            signs = list(Sign.objects.filter(
+                            id__in=sign_ids[i:i + chunk_size],
+                            sign_template_id__in=sign_templates.keys(),
+                            ).select_related('zone', 'position', 'project').prefetch_related(
+                            'attribute_instances__attribute',
+                            'position__attribute_instances__attribute',
+                            'sign_messages__attribute_instances__attribute',
+                            ))
+            for sign in signs:
+                sign.sign_template = sign_templates[sign.sign_template_id]
+
+            for chunk_errors in pool.map(_render_artwork, [(signs[j::workers], priority) for j in range(workers)]):
+                errors.extend(chunk_errors)
+            rendered += len(signs)
+            incr_stat("artwork:executed", len(signs))
+
+            elapsed = time.time() - chunk_started
+            print "Generating artwork. Chunk {0}/{1}: {2} signs in {3:.1f}s ({4:.1f} signs/s), {5} signs so far ({6:.1f} signs/s)".format(
+                chunk_num + 1, num_chunks, len(signs), elapsed, len(signs) / max(elapsed, 0.001),
+                rendered, rendered / max(time.time() - started, 0.001))
+    finally:
+        pool.close()
+        pool.join()
+
+    artwork_store().maybe_trim()
+
+    if errors:
+        print "Generating artwork. {0} signs failed: {1}".format(len(errors), ", ".join(str(sign_id) for sign_id, e in errors))
+        raise errors[0][1]
     print "Generating artwork. Done."
 jobber.connect(generate_artwork, name='sign:generate_artwork', dispatch_uid='sign:generate_artwork')
+
+API_JSON_FIELDS = ('message_json', 'repeating_message_json', 'meta_json')
+
+def store_api_json(sign_ids, chunk_size=200):
+    """ Recompute the stored api json (see api_json_for_signs) of some signs. Only the rows that actually
+        changed are written, with one update per chunk, and only those signs get their api sync info bumped.
+        returns the ids of the signs that changed
+    """
+    sign_ids = sorted(set(sign_ids))
+    changed_ids = []
+    for i in range(0, len(sign_ids), chunk_size):
+        signs = list(Sign.objects.filter(id__in=sign_ids[i:i + chunk_size]).select_related('zone', 'position').prefetch_related(
+                        'attribute_instances__attribute',
+                        'sign_messages__attribute_instances__attribute',
+                        ))
+        api_json = api_json_for_signs(signs)
+        changed = [sign for sign in signs if tuple(getattr(sign, field) for field in API_JSON_FIELDS) != api_json[sign.id]]
+        if not changed:
+            continue
+
+        updates = {}
+        for n, field in enumerate(API_JSON_FIELDS):
+            updates[field] = models.Case(
+                *[models.When(id=sign.id, then=models.Value(api_json[sign.id][n])) for sign in changed],
+                default=models.F(field),
+                output_field=models.TextField()
+                )
+        Sign.objects.filter(id__in=[sign.id for sign in changed]).update(**updates)
+
+        # update() skips the post_save signal (api sync info)
+        for sign in changed:
+            for field, value in zip(API_JSON_FIELDS, api_json[sign.id]):
+                setattr(sign, field, value)
+            models.signals.post_save.send(sender=Sign, instance=sign, created=False, update_fields=API_JSON_FIELDS, raw=False, using=sign._state.db)
+        changed_ids.extend(sign.id for sign in changed)
+    return changed_ids
+
+def request_api_json_refresh(kind, ids):
+    """ Refresh the stored api json of the signs under some objects, in the background.
+        `kind` is one of "sign", "sign_message", "position", "zone", "sign_template" or "project".
+        Requests made within a transaction are sent as a single job when it commits.
+
+        Outside of a transaction (eg. each attribute instance of a form saved in autocommit) the objects go
+        to a sign:refresh_api_json job a few seconds later (SIGN_API_JSON_REFRESH_DELAY), and an object that
+        is already waiting on that job isn't sent again.
+    """
+    ids = [obj_id for obj_id in ids if obj_id]
+    if not ids:
+        return
+    items = [(kind, obj_id) for obj_id in ids]
+    if connection.in_atomic_block:
+        on_commit_batch("sign:refresh_api_json", items, _send_api_json_job)
+    else:
+        delay_seconds = getattr(settings, 'SIGN_API_JSON_REFRESH_DELAY', 5)
+        # pending until the job starts. the timeout is a safety net for jobs that never run
+        items = [item for item in OrderedDict.fromkeys(items) if cache.add(_api_json_pending_key(*item), 1, delay_seconds + 300)]
+        if items:
+            _send_api_json_job(items, delay_seconds=delay_seconds)
+
+def _api_json_pending_key(kind, obj_id):
+    return "sign_api_json_pending:{0}:{1}".format(kind, obj_id)
+
+def _send_api_json_job(items, delay_seconds=None):
+    targets = OrderedDict()
+    for kind, obj_id in items:
+        targets.setdefault(kind + "_ids", set()).add(obj_id)
+    kwargs = dict((k, sorted(v)) for k, v in targets.items())
+    if delay_seconds:
+        kwargs['delay_seconds'] = delay_seconds
+    jobber.send(name='sign:refresh_api_json', **kwargs)
+
+def refresh_api_json(**kwargs):
+    """ refresh the stored api json
+        `job = jobber.send(name='sign:refresh_api_json', sign_ids=[self.id,], zone_ids=[zone.id,])`
+        (sign_ids, sign_message_ids, position_ids, zone_ids, sign_template_ids and project_ids are all optional)
+    """
+    print "Refreshing api json..."
+    lookups = {
+        'sign_ids': 'id__in',
+        'sign_message_ids': 'sign_messages__id__in',
+        'position_ids': 'position_id__in',
+        'zone_ids': 'zone_id__in',
+        'sign_template_ids': 'sign_template_id__in',
+        'project_ids': 'project_id__in',
+    }
+    query = models.Q(pk__in=[])
+    pending = []
+    for name, lookup in lookups.items():
+        if kwargs.get(name):
+            query |= models.Q(**{lookup: kwargs[name]})
+            pending.extend(_api_json_pending_key(name[:-len("_ids")], obj_id) for obj_id in kwargs[name])
+    # changes from here on need a new job
+    cache.delete_many(pending)
+    sign_ids = Sign.objects.filter(query).values_list('id', flat=True).distinct()
+    changed_ids = store_api_json(sign_ids)
+    print "Refreshing api json. Done, {0} signs changed.".format(len(changed_ids))
+jobber.connect(refresh_api_json, name='sign:refresh_api_json', dispatch_uid='sign:refresh_api_json')
+
+_placeholders = {}
+def generating_artwork_placeholder():
+    """ the 'in progress' png, served while artwork or previews are being generated (read once per process) """
+    if 'generating' not in _placeholders:
+        with open("{0}/sign/static/sign/generating_artwork.png".format(settings.BASE_DIR), "rb") as f:
+            _placeholders['generating'] = f.read()
+    return _placeholders['generating']
+
+def override_preview_widths():
+    """ the (size, width) of the override pdf previews. "detail" is stored as override_pdf_as_png """
+    return getattr(settings, 'SIGN_OVERRIDE_PREVIEW_WIDTHS', (
+        ("thumbnail", 150),
+        ("list", 300),
+        ("detail", 500),
+    ))
+
+def request_override_previews(sign_id, override_pdf_name):
+    """ queue generate_override_previews for an uploaded override pdf, once the upload is committed """
+    transaction.on_commit(lambda: jobber.send(name='sign:generate_override_previews', sign_id=sign_id, override_pdf=override_pdf_name))
+
+def generate_override_previews(**kwargs):
+    """ rasterize the first page of an override pdf into the preview pngs
+        `job = jobber.send(name='sign:generate_override_previews', sign_id=self.id, override_pdf=self.override_pdf.name)`
+
+        Only page [0] is decoded, once, at 100 dpi, within the SIGN_OVERRIDE_PDF_LIMITS resource limits.
+        Every preview width is resized from that one image.
+    """
+    from wand.resource import limits
+
+    sign = Sign.objects.filter(id=kwargs.pop('sign_id')).first()
+    override_pdf = kwargs.pop('override_pdf')
+    if sign is None or sign.override_pdf.name != override_pdf:
+        # deleted, or replaced by a newer upload (which has its own job)
+        print "Generating override previews. Skipped, the override pdf has changed."
+        return
+
+    for resource, limit in getattr(settings, 'SIGN_OVERRIDE_PDF_LIMITS', {
+            'memory': 256 * 1024 * 1024,
+            'map': 512 * 1024 * 1024,
+            'width': 20000,
+            'height': 20000,
+            'area': 100 * 1000 * 1000,
+            }).items():
+        limits[resource] = limit
+
+    # ghostscript wants a real file, and the storage may be remote
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        sign.override_pdf.open("rb")
+        try:
+            for chunk in sign.override_pdf.chunks():
+                tmp.write(chunk)
+        finally:
+            sign.override_pdf.close()
+        tmp.flush()
+
+        previews = []
+        with Image(filename=tmp.name + "[0]", resolution=100) as img:
+            for size, width in override_preview_widths():
+                with img.clone() as preview:
+                    preview.resize(width=width, height=max(1, int(img.height * width / img.width)))
+                    with preview.convert("PNG") as converted_img:
+                        previews.append((size, converted_img.make_blob()))
+
+    # the detail preview names the others
+    previews = OrderedDict(previews)
+    storage = sign.override_pdf_as_png.storage
+    detail_name = storage.save(u"sign_override_artwork_%s.png" % sign.id, ContentFile(previews.pop("detail")))
+    sign.override_pdf_as_png.name = detail_name
+    for size, content in previews.items():
+        name = sign.override_preview_name(size)
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(content))
+
+    updated = Sign.objects.filter(id=sign.id, override_pdf=override_pdf).update(override_pdf_as_png=detail_name)
+    if updated:
+        # update() skips the post_save signal (api sync info)
+        models.signals.post_save.send(sender=Sign, instance=sign, created=False, update_fields=['override_pdf_as_png'], raw=False, using=sign._state.db)
+    print "Generating override previews. Done."
+jobber.connect(generate_override_previews, name='sign:generate_override_previews', dispatch_uid='sign:generate_override_previews')